@@ -0,0 +1,149 @@
+-- Agregados pré-calculados das análises OLAP do relatório (app_/agregados.py)
+--
+-- As consultas do ponto 5 do relatório percorrem estatisticas_voos inteira a
+-- cada execução. Aqui os seus resultados ficam guardados em tabelas pequenas,
+-- ao nível de detalhe necessário para o drill down, e os endpoints
+-- /admin/estatisticas/* só leem estas tabelas.
+--
+-- atualizar_agregados() recalcula tudo a partir de estatisticas_voos (a
+-- tabela de estatisticas.sql ou a vista materializada do relatório, que é
+-- refrescada primeiro) e regista a hora em agregado_atualizacao; as respostas
+-- dizem quão antigos são os dados. É chamada periodicamente por
+-- `python agregados.py atualizar --intervalo SEGUNDOS` (ver Procfile) ou por
+-- POST /admin/estatisticas/atualizar.
+--
+-- Nos agregados por local cada voo conta uma vez em cada país e cidade por
+-- onde passa (partida ou chegada), e uma só vez no total global.
+
+
+-- Ocupação por rota (par de cidades, em qualquer sentido) e mês
+CREATE TABLE IF NOT EXISTS agregado_rotas (
+    cidade1 VARCHAR(255) NOT NULL,
+    cidade2 VARCHAR(255) NOT NULL,
+    ano INTEGER NOT NULL,
+    mes INTEGER NOT NULL,
+    voos BIGINT NOT NULL,
+    passageiros BIGINT NOT NULL,
+    assentos BIGINT NOT NULL,
+    PRIMARY KEY (cidade1, cidade2, ano, mes)
+);
+
+-- Último voo de cada avião em cada rota
+CREATE TABLE IF NOT EXISTS agregado_frota (
+    cidade1 VARCHAR(255) NOT NULL,
+    cidade2 VARCHAR(255) NOT NULL,
+    no_serie VARCHAR(80) NOT NULL,
+    voos BIGINT NOT NULL,
+    ultimo_voo TIMESTAMP NOT NULL,
+    PRIMARY KEY (cidade1, cidade2, no_serie)
+);
+
+-- Vendas em todos os níveis espaço (global > pais > cidade) x tempo
+-- (global > ano > mes > dia): nivel_espaco 0..2 e nivel_tempo 0..3 dizem
+-- quantas das colunas de cada dimensão estão preenchidas; as outras são NULL
+CREATE TABLE IF NOT EXISTS agregado_vendas (
+    nivel_espaco SMALLINT NOT NULL,
+    nivel_tempo SMALLINT NOT NULL,
+    pais VARCHAR(255),
+    cidade VARCHAR(255),
+    ano INTEGER,
+    mes INTEGER,
+    dia INTEGER,
+    voos BIGINT NOT NULL,
+    vendas_1c NUMERIC NOT NULL,
+    vendas_2c NUMERIC NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_agregado_vendas
+    ON agregado_vendas (nivel_espaco, nivel_tempo, pais, cidade, ano, mes, dia);
+
+-- Passageiros e assentos por classe, dia da semana e local (global > pais > cidade)
+CREATE TABLE IF NOT EXISTS agregado_classes (
+    nivel_espaco SMALLINT NOT NULL,
+    pais VARCHAR(255),
+    cidade VARCHAR(255),
+    dia_da_semana INTEGER NOT NULL,
+    passageiros_1c BIGINT NOT NULL,
+    passageiros_2c BIGINT NOT NULL,
+    assentos_1c BIGINT NOT NULL,
+    assentos_2c BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_agregado_classes ON agregado_classes (nivel_espaco, pais, cidade);
+
+-- Uma só linha: quando e em quanto tempo foram calculados os agregados
+CREATE TABLE IF NOT EXISTS agregado_atualizacao (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    atualizado TIMESTAMPTZ NOT NULL,
+    duracao_ms DOUBLE PRECISION NOT NULL
+);
+
+
+-- Recalcula todos os agregados numa transação: as leituras continuam a ver os
+-- valores anteriores até ao commit, e duas atualizações nunca correm ao mesmo
+-- tempo. Nos agregados por local, o LATERAL dá os locais de cada voo em cada
+-- nível (global, países e cidades de partida e chegada), sem repetições.
+CREATE OR REPLACE FUNCTION atualizar_agregados() RETURNS TIMESTAMPTZ AS $$
+DECLARE
+    inicio TIMESTAMPTZ := clock_timestamp();
+BEGIN
+    LOCK TABLE agregado_atualizacao IN EXCLUSIVE MODE;
+
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'estatisticas_voos') THEN
+        REFRESH MATERIALIZED VIEW estatisticas_voos;
+    END IF;
+
+    DELETE FROM agregado_rotas;
+    INSERT INTO agregado_rotas
+    SELECT LEAST(cidade_partida, cidade_chegada), GREATEST(cidade_partida, cidade_chegada), ano, mes,
+           COUNT(*), SUM(passageiros_1c + passageiros_2c), SUM(assentos_1c + assentos_2c)
+    FROM estatisticas_voos
+    GROUP BY 1, 2, 3, 4;
+
+    DELETE FROM agregado_frota;
+    INSERT INTO agregado_frota
+    SELECT LEAST(cidade_partida, cidade_chegada), GREATEST(cidade_partida, cidade_chegada), no_serie,
+           COUNT(*), MAX(hora_partida)
+    FROM estatisticas_voos
+    GROUP BY 1, 2, 3;
+
+    DELETE FROM agregado_vendas;
+    INSERT INTO agregado_vendas
+    SELECT l.nivel_espaco, 3 - GROUPING(e.ano) - GROUPING(e.mes) - GROUPING(e.dia_do_mes),
+           l.pais, l.cidade, e.ano, e.mes, e.dia_do_mes,
+           COUNT(*), COALESCE(SUM(e.vendas_1c), 0), COALESCE(SUM(e.vendas_2c), 0)
+    FROM estatisticas_voos e
+    CROSS JOIN LATERAL (
+        SELECT 0, NULL, NULL
+        UNION SELECT 1, e.pais_partida, NULL
+        UNION SELECT 1, e.pais_chegada, NULL
+        UNION SELECT 2, e.pais_partida, e.cidade_partida
+        UNION SELECT 2, e.pais_chegada, e.cidade_chegada
+    ) AS l(nivel_espaco, pais, cidade)
+    GROUP BY l.nivel_espaco, l.pais, l.cidade,
+             GROUPING SETS ((), (e.ano), (e.ano, e.mes), (e.ano, e.mes, e.dia_do_mes));
+
+    DELETE FROM agregado_classes;
+    INSERT INTO agregado_classes
+    SELECT l.nivel_espaco, l.pais, l.cidade, e.dia_da_semana,
+           SUM(e.passageiros_1c), SUM(e.passageiros_2c), SUM(e.assentos_1c), SUM(e.assentos_2c)
+    FROM estatisticas_voos e
+    CROSS JOIN LATERAL (
+        SELECT 0, NULL, NULL
+        UNION SELECT 1, e.pais_partida, NULL
+        UNION SELECT 1, e.pais_chegada, NULL
+        UNION SELECT 2, e.pais_partida, e.cidade_partida
+        UNION SELECT 2, e.pais_chegada, e.cidade_chegada
+    ) AS l(nivel_espaco, pais, cidade)
+    GROUP BY l.nivel_espaco, l.pais, l.cidade, e.dia_da_semana;
+
+    INSERT INTO agregado_atualizacao (atualizado, duracao_ms)
+    VALUES (now(), EXTRACT(EPOCH FROM clock_timestamp() - inicio) * 1000)
+    ON CONFLICT (id) DO UPDATE SET atualizado = EXCLUDED.atualizado, duracao_ms = EXCLUDED.duracao_ms;
+
+    RETURN now();
+END;
+$$ LANGUAGE plpgsql;
+
+
+SELECT atualizar_agregados();
@@ -0,0 +1,5 @@
+#!/usr/bin/python3
+from app_async import app
+
+if __name__ == "__main__":
+    app.run()
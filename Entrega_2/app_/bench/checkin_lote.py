@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""Compara o check-in bilhete a bilhete com o check-in em lote.
+
+Cria R reservas de K bilhetes sem lugar num voo (diretamente na base de dados
+em DATABASE_URL) e faz o check-in de todos de três formas, repondo os lugares a
+NULL entre elas:
+
+  - bilhete:  um POST /checkin/<bilhete> por bilhete (o que um cliente tinha
+              de fazer antes), com -c pedidos em paralelo
+  - reserva:  um POST /reservas/<reserva>/checkin?nif= por reserva
+  - voo:      um só POST /admin/voos/<voo>/checkin (só com --admin-token)
+
+Para cada uma mostra o tempo total, os pedidos feitos e quantas reservas
+ficaram lado a lado (todos os bilhetes na mesma fila, em letras seguidas).
+
+Uso:
+    python bench/checkin_lote.py --url http://localhost:8080 -r 20 -k 4 [--admin-token TOKEN]
+
+A API tem de correr sem o rate limit por defeito (FLASK_RATELIMIT_ENABLED=false).
+"""
+import argparse
+import os
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+
+from checkin import DATABASE_URL, checkin, criar_bilhetes
+
+NIF = "999999999"
+
+# Reservas com os lugares todos na mesma fila e em letras seguidas
+LADO_A_LADO = """
+    SELECT count(*) FILTER (
+               WHERE filas = 1 AND max_letra - min_letra + 1 = bilhetes AND bilhetes = letras
+           ) AS lado_a_lado,
+           count(*) AS reservas,
+           sum(sem_lugar) AS sem_lugar
+    FROM (
+        SELECT codigo_reserva,
+               count(DISTINCT substring(lugar, '^[0-9]+')) AS filas,
+               count(DISTINCT right(lugar, 1)) AS letras,
+               max(ascii(right(lugar, 1))) AS max_letra,
+               min(ascii(right(lugar, 1))) AS min_letra,
+               count(*) AS bilhetes,
+               count(*) FILTER (WHERE lugar IS NULL) AS sem_lugar
+        FROM bilhete
+        WHERE codigo_reserva = ANY(%s)
+        GROUP BY codigo_reserva
+    ) r
+    """
+
+
+def post(url, caminho, cabecalhos=None):
+    pedido = urllib.request.Request(f"{url}{caminho}", method="POST", headers=cabecalhos or {})
+    try:
+        with urllib.request.urlopen(pedido, timeout=60) as resposta:
+            return resposta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--voo", type=int, help="voo a usar (default: o que tem menos lugares ocupados)")
+    parser.add_argument("-r", "--reservas", type=int, default=20, help="número de reservas (default: 20)")
+    parser.add_argument("-k", "--bilhetes", type=int, default=4, help="bilhetes por reserva (default: 4)")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="pedidos em paralelo (default: 10)")
+    parser.add_argument("--prim-classe", action="store_true", help="bilhetes de primeira classe")
+    parser.add_argument("--admin-token", default=os.environ.get("ADMIN_TOKEN"), help="para medir também o voo")
+    args = parser.parse_args()
+
+    with psycopg.connect(args.database_url, autocommit=True) as conn:
+        voo, reservas, bilhetes = args.voo, [], []
+        try:
+            for _ in range(args.reservas):
+                voo, codigo_reserva, ids = criar_bilhetes(conn, voo, args.bilhetes, args.prim_classe)
+                reservas.append(codigo_reserva)
+                bilhetes.extend(ids)
+
+            casos = {
+                "bilhete": (bilhetes, lambda b: checkin(args.url, b)[0]),
+                "reserva": (reservas, lambda r: post(args.url, f"/reservas/{r}/checkin?nif={NIF}")),
+            }
+            if args.admin_token:
+                cabecalhos = {"Authorization": f"Bearer {args.admin_token}"}
+                casos["voo"] = ([voo], lambda v: post(args.url, f"/admin/voos/{v}/checkin", cabecalhos))
+
+            print(f"voo {voo}: {len(reservas)} reservas de {args.bilhetes} bilhetes, {args.concurrency} em paralelo")
+            print(f"  {'check-in':<10}{'pedidos':>9}{'s':>9}{'lado a lado':>14}{'sem lugar':>11}  respostas")
+            for nome, (itens, funcao) in casos.items():
+                conn.execute("UPDATE bilhete SET lugar = NULL WHERE codigo_reserva = ANY(%s)", (reservas,))
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    estados = Counter(executor.map(funcao, itens))
+                duracao = time.perf_counter() - inicio
+                lado_a_lado, total, sem_lugar = conn.execute(LADO_A_LADO, (reservas,)).fetchone()
+                respostas = ", ".join(f"{estado}: {n}" for estado, n in sorted(estados.items(), key=str))
+                print(f"  {nome:<10}{len(itens):>9}{duracao:>9.3f}{f'{lado_a_lado}/{total}':>14}{sem_lugar:>11}  {respostas}")
+        finally:
+            with conn.transaction():
+                conn.execute("DELETE FROM bilhete WHERE codigo_reserva = ANY(%s)", (reservas,))
+                conn.execute("DELETE FROM venda WHERE codigo_reserva = ANY(%s)", (reservas,))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+"""Mostra o partition pruning de particoes.sql nas consultas da API e do relatório.
+
+Compara duas bases de dados com os mesmos dados: uma com o esquema de
+aviacao.sql (--heap) e uma cópia migrada com migrar_particoes.sql
+(--particoes). Por exemplo, com o dataset 10x:
+
+    createdb aviacao10 && psql -d aviacao10 -f aviacao.sql -f ... (capacidade.sql, estatisticas.sql, ...)
+    DATABASE_URL=.../aviacao10 python gerador.py --scale 10 --mode db --disable-triggers
+    createdb -T aviacao10 aviacao10p && psql -d aviacao10p -f migrar_particoes.sql
+
+Corre cada consulta com EXPLAIN (ANALYZE, BUFFERS) -n vezes em cada base de
+dados e mostra a mediana do tempo de planeamento e de execução, os blocos
+lidos e, na particionada, quantas partições de voo, venda e bilhete o plano
+leu de facto (as que a poda tirou do plano, ou que nunca chegaram a executar,
+não contam).
+
+As consultas da API são as do registo (registo.REGISTO e, na particionada,
+registo.PARTICOES), com os parâmetros de um pedido a --agora. As do
+relatório são as análises com intervalo de tempo (o último ano, os últimos 3
+meses, as vendas de um dia) calculadas sobre voo, venda e bilhete; na
+particionada dizem também a hora_partida dos bilhetes, que é o que permite
+podar bilhete.
+
+Com --generico os planos são genéricos, como os dos prepared statements da
+API (registo.py): a poda faz-se ao abrir o plano, com os valores dos
+parâmetros, e não no planeamento. Cada execução volta a fazer o PREPARE,
+por isso o tempo de plano é o do primeiro pedido de cada ligação.
+
+Uso:
+    python bench/particoes.py --heap postgres://.../aviacao10 --particoes postgres://.../aviacao10p \\
+        [--agora "2025-06-15 08:00"] [-n 5] [--generico]
+"""
+import argparse
+import re
+import statistics
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import psycopg
+from psycopg.rows import namedtuple_row
+from psycopg.sql import Literal
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import registo  # noqa: E402
+
+TABELAS = ("voo", "venda", "bilhete")
+
+PARAMETRO = re.compile(r"%\((\w+)\)s")
+
+# Consultas da API medidas (nome no registo)
+API = (
+    "lista_voo",
+    "list_flights",
+    "lista_partidas",
+    "assentos_voo",
+    "compra:voos",
+    "checkin:bilhete",
+    "lista_bilhetes_voo",
+    "lista_bilhetes_reserva",
+)
+
+# Análises do relatório com intervalo de tempo: (heap, particionada). Na
+# particionada, {bilhete} acrescenta as condições sobre b.hora_partida.
+ROTAS_ANO = """
+    /* rotas_ultimo_ano */
+    SELECT LEAST(a1.cidade, a2.cidade) AS cidade1, GREATEST(a1.cidade, a2.cidade) AS cidade2,
+           count(DISTINCT v.id) AS voos, count(b.id) AS passageiros
+    FROM voo v
+    JOIN aeroporto a1 ON a1.codigo = v.partida
+    JOIN aeroporto a2 ON a2.codigo = v.chegada
+    LEFT JOIN bilhete b ON b.voo_id = v.id{bilhete}
+    WHERE v.hora_partida >= %(agora)s - INTERVAL '1 year' AND v.hora_partida < %(agora)s
+    GROUP BY 1, 2
+    """
+
+# Rotas onde voaram todos os aviões que voaram nos últimos 3 meses (a análise
+# do relatório, com um GROUP BY em vez do NOT EXISTS ... EXCEPT por voo)
+FROTA_3_MESES = """
+    /* frota_ultimos_3_meses */
+    WITH janela AS (
+        SELECT v.no_serie, LEAST(a1.cidade, a2.cidade) AS cidade1, GREATEST(a1.cidade, a2.cidade) AS cidade2
+        FROM voo v
+        JOIN aeroporto a1 ON a1.codigo = v.partida
+        JOIN aeroporto a2 ON a2.codigo = v.chegada
+        WHERE v.hora_partida >= %(agora)s - INTERVAL '3 months' AND v.hora_partida < %(agora)s
+    )
+    SELECT cidade1, cidade2
+    FROM janela
+    GROUP BY cidade1, cidade2
+    HAVING count(DISTINCT no_serie) = (SELECT count(DISTINCT no_serie) FROM janela)
+    """
+
+# Vendas de um dia, por hora. Pela RI-3 os bilhetes de uma venda são de voos
+# que partem depois dela, o que na particionada poda os meses anteriores.
+VENDAS_DIA = """
+    /* vendas_por_hora */
+    SELECT date_trunc('hour', ve.hora) AS hora, count(DISTINCT ve.codigo_reserva) AS vendas,
+           count(b.id) AS bilhetes, sum(b.preco) AS total
+    FROM venda ve
+    LEFT JOIN bilhete b ON b.codigo_reserva = ve.codigo_reserva{bilhete}
+    WHERE ve.hora >= %(dia)s AND ve.hora < %(dia)s + INTERVAL '1 day'
+    GROUP BY 1
+    ORDER BY 1
+    """
+
+RELATORIO = {
+    "rotas_ultimo_ano": (
+        ROTAS_ANO.format(bilhete=""),
+        ROTAS_ANO.format(
+            bilhete="\n                       AND b.hora_partida = v.hora_partida"
+            "\n                       AND b.hora_partida >= %(agora)s - INTERVAL '1 year'"
+            " AND b.hora_partida < %(agora)s"
+        ),
+    ),
+    "frota_ultimos_3_meses": (FROTA_3_MESES, FROTA_3_MESES),
+    "vendas_por_hora": (
+        VENDAS_DIA.format(bilhete=""),
+        VENDAS_DIA.format(bilhete=" AND b.hora_partida > %(dia)s"),
+    ),
+}
+
+# Um voo que parte depois de agora, um bilhete e a venda dele
+AMOSTRA = """
+    SELECT v.id AS voo, v.partida, v.chegada, b.id AS bilhete, ve.codigo_reserva AS reserva, ve.nif_cliente AS nif
+    FROM voo v
+    JOIN bilhete b ON b.voo_id = v.id
+    JOIN venda ve ON ve.codigo_reserva = b.codigo_reserva
+    WHERE v.hora_partida > %s
+    ORDER BY v.hora_partida, b.id
+    LIMIT 1
+    """
+
+PARTICOES = """
+    SELECT i.inhrelid::regclass::text, i.inhparent::regclass::text
+    FROM pg_inherits i
+    WHERE i.inhparent = ANY(%s::regclass[])
+    """
+
+
+def parametros_api(amostra, agora):
+    dia = datetime.combine(agora.date(), datetime.min.time())
+    voo = {"voo": amostra.voo}
+    pagina = {"id": 0, "limite": 1000}
+    return {
+        "lista_voo": {"partida": amostra.partida, "now": agora, "later": agora + timedelta(hours=12)},
+        "list_flights": {"partida": amostra.partida, "chegada": amostra.chegada, "now": agora, "prim_classe": None},
+        "lista_partidas": {
+            "partida": amostra.partida, "desde": dia, "ate": dia + timedelta(days=1),
+            "hora_partida": dia, "limite": 1000, "id": 0,
+        },
+        "assentos_voo": voo,
+        "compra:voos": {"voos": [amostra.voo]},
+        "checkin:bilhete": {"bilhete": amostra.bilhete},
+        "lista_bilhetes_voo": {**voo, **pagina},
+        "lista_bilhetes_reserva": {"reserva": amostra.reserva, "nif": amostra.nif, **pagina},
+    }
+
+
+def tipo(valor):
+    """o tipo com que a aplicação envia o valor (inteiros como int8, ver registo.usar_int8)"""
+
+    if isinstance(valor, bool):
+        return "boolean"
+    if isinstance(valor, int):
+        return "bigint"
+    if isinstance(valor, datetime):
+        return "timestamp"
+    if isinstance(valor, list) and valor and all(isinstance(v, int) for v in valor):
+        return "bigint[]"
+    return "unknown"
+
+
+def preparar(cur, sql, parametros):
+    """PREPARE com $1, $2, ... no lugar de %(nome)s; devolve o EXECUTE com os valores"""
+
+    nomes = []
+
+    def marcador(m):
+        if m.group(1) not in nomes:
+            nomes.append(m.group(1))
+        return f"${nomes.index(m.group(1)) + 1}"
+
+    sql = PARAMETRO.sub(marcador, sql)
+    tipos = ", ".join(tipo(parametros[nome]) for nome in nomes)
+    cur.execute("DEALLOCATE ALL")
+    cur.execute(f"PREPARE consulta ({tipos}) AS {sql}" if nomes else f"PREPARE consulta AS {sql}")
+    valores = ", ".join(Literal(parametros[nome]).as_string(cur.connection) for nome in nomes)
+    return f"EXECUTE consulta({valores})", None
+
+
+def nos(plano):
+    yield plano
+    for filho in plano.get("Plans", ()):
+        yield from nos(filho)
+
+
+def medir(conn, sql, parametros, n, generico, particoes):
+    """(planeamento ms, execução ms, blocos, {tabela: partições lidas}) de n execuções"""
+
+    planeamento, execucao = [], []
+    with conn.cursor() as cur:
+        for _ in range(n):
+            if generico:
+                sql_explain, parametros_explain = preparar(cur, sql, parametros)
+            else:
+                sql_explain, parametros_explain = sql, parametros
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql_explain}", parametros_explain)
+            (resultado,) = cur.fetchone()[0]
+            conn.rollback()
+            planeamento.append(resultado["Planning Time"])
+            execucao.append(resultado["Execution Time"])
+
+    plano = resultado["Plan"]
+    blocos = plano.get("Shared Hit Blocks", 0) + plano.get("Shared Read Blocks", 0)
+    lidas = {}
+    for no in nos(plano):
+        tabela = particoes.get(no.get("Relation Name"))
+        if tabela is not None and no.get("Actual Loops", 0) > 0:
+            lidas.setdefault(tabela, set()).add(no["Relation Name"])
+    return statistics.median(planeamento), statistics.median(execucao), blocos, lidas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--heap", required=True, help="base de dados com o esquema de aviacao.sql")
+    parser.add_argument("--particoes", required=True, help="a mesma, migrada com migrar_particoes.sql")
+    parser.add_argument("--agora", type=datetime.fromisoformat, default=datetime(2025, 6, 15, 8),
+                        help="o agora das consultas (default: 2025-06-15 08:00, dentro dos dados do gerador)")
+    parser.add_argument("-n", type=int, default=5, help="execuções de cada consulta (default: 5)")
+    parser.add_argument("--generico", action="store_true", help="planos genéricos, como os prepared statements")
+    args = parser.parse_args()
+
+    with psycopg.connect(args.heap) as heap, psycopg.connect(args.particoes) as particionada:
+        for conn in (heap, particionada):
+            registo.usar_int8(conn)
+            if args.generico:
+                conn.execute("SET plan_cache_mode = force_generic_plan")
+                conn.commit()
+
+        cur = heap.cursor(row_factory=namedtuple_row)
+        amostra = cur.execute(AMOSTRA, (args.agora,)).fetchone()
+        contagens = {t: heap.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in TABELAS}
+        heap.rollback()
+
+        particoes = dict(particionada.execute(PARTICOES, (list(TABELAS),)).fetchall())
+        total = {t: sum(1 for p in particoes.values() if p == t) for t in TABELAS}
+        particionada.rollback()
+
+        consultas_particoes = {**registo.REGISTO, **registo.PARTICOES}
+        parametros = parametros_api(amostra, args.agora)
+        casos = [
+            (nome, registo.REGISTO[nome].sql, consultas_particoes[nome].sql, parametros[nome]) for nome in API
+        ]
+        dia = datetime.combine(args.agora.date(), datetime.min.time())
+        casos += [
+            (nome, sql_heap, sql_particoes, {"agora": args.agora, "dia": dia})
+            for nome, (sql_heap, sql_particoes) in RELATORIO.items()
+        ]
+
+        print(", ".join(f"{t} {n}" for t, n in contagens.items()), end="; ")
+        print(", ".join(f"{n} partições de {t}" for t, n in total.items()))
+        planos = "genéricos" if args.generico else "personalizados"
+        print(f"agora = {args.agora:%Y-%m-%d %H:%M}, voo {amostra.voo}, planos {planos}, mediana de {args.n} (ms)")
+        print(f"  {'':<24}{'heap':>26}{'particionada':>26}")
+        print(f"  {'consulta':<24}{'plano':>9}{'execução':>9}{'blocos':>8}{'plano':>9}{'execução':>9}{'blocos':>8}"
+              "  partições lidas")
+        for nome, sql_heap, sql_particoes, valores in casos:
+            p_h, e_h, b_h, _ = medir(heap, sql_heap, valores, args.n, args.generico, {})
+            p_p, e_p, b_p, lidas = medir(particionada, sql_particoes, valores, args.n, args.generico, particoes)
+            resumo = ", ".join(f"{t} {len(lidas[t])}/{total[t]}" for t in TABELAS if t in lidas)
+            print(f"  {nome:<24}{p_h:>9.2f}{e_h:>9.2f}{b_h:>8}{p_p:>9.2f}{e_p:>9.2f}{b_p:>8}  {resumo}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Cache das respostas dos endpoints de leitura.
+
+As respostas são guardadas por ETag, e a ETag é derivada da versão dos dados
+na tabela versao_dados (ver Entrega_2/versoes.sql), que os triggers de voo e
+aeroporto incrementam em cada alteração. Como a versão vem da base de dados,
+todos os workers do gunicorn calculam a mesma ETag para os mesmos dados e
+qualquer um pode responder 304 a um If-None-Match emitido por outro.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Com etiqueta, como as instruções de consultas.py
+VERSOES = "/* versoes */ SELECT tabela, versao FROM versao_dados"
+
+
+class CacheTTL:
+    """Dicionário LRU com número máximo de entradas e expiração por tempo."""
+
+    def __init__(self, maximo=1024, ttl=60.0):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, chave):
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self.entradas[chave]
+                return None
+            self.entradas.move_to_end(chave)
+            return valor
+
+    def put(self, chave, valor):
+        with self.lock:
+            self.entradas[chave] = (time.monotonic() + self.ttl, valor)
+            self.entradas.move_to_end(chave)
+            while len(self.entradas) > self.maximo:
+                self.entradas.popitem(last=False)
+
+
+class VersoesDados:
+    """Versões de versao_dados, relidas da base de dados no máximo a cada `ttl` segundos.
+
+    Dentro desse intervalo um pedido condicional é respondido sem ir à base de
+    dados; uma alteração a voo ou aeroporto demora no máximo `ttl` segundos a
+    invalidar as ETags deste worker.
+    """
+
+    def __init__(self, pool, ttl=2.0):
+        self.pool = pool
+        self.ttl = ttl
+        self.versoes = {}
+        self.expira = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, tabela):
+        with self.lock:
+            if self.expira < time.monotonic():
+                with self.pool.connection() as conn:
+                    self.versoes = dict(conn.execute(VERSOES).fetchall())
+                self.expira = time.monotonic() + self.ttl
+            return self.versoes[tabela]
+
+
+class VersoesDadosAsync(VersoesDados):
+    """VersoesDados sobre um AsyncConnectionPool, para app_async.py."""
+
+    def __init__(self, pool, ttl=2.0):
+        super().__init__(pool, ttl)
+        self.lock = asyncio.Lock()
+
+    async def get(self, tabela):
+        async with self.lock:
+            if self.expira < time.monotonic():
+                async with self.pool.connection() as conn:
+                    cur = await conn.execute(VERSOES)
+                    self.versoes = dict(await cur.fetchall())
+                self.expira = time.monotonic() + self.ttl
+            return self.versoes[tabela]
+
+
+def etag(tabela, versao, *chave):
+    """ETag de uma resposta: a versão da tabela mais os parâmetros do pedido."""
+    return hashlib.blake2b(repr((tabela, versao) + chave).encode(), digest_size=12).hexdigest()
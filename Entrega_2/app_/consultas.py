@@ -0,0 +1,639 @@
+"""SQL e validação partilhados pelas duas versões da API.
+
+app.py (Flask, síncrona) e app_async.py (Quart, assíncrona) executam as mesmas
+instruções com os mesmos parâmetros; só muda a forma de esperar pela base de
+dados. Tudo o que não faz I/O fica aqui para que as respostas JSON das duas
+versões sejam iguais.
+
+Cada instrução começa com o nome do handler numa etiqueta /* ... */, que o
+pg_stat_statements guarda no texto da consulta (ver desempenho.py).
+"""
+import base64
+import binascii
+import json
+import random
+from datetime import date, datetime, timedelta
+
+# Valores de ?classe= e o prim_classe correspondente (None: qualquer classe)
+CLASSES = {None: None, "primeira": True, "segunda": False}
+
+AEROPORTOS = """
+    /* list_aeroportos */
+    SELECT nome, cidade
+    FROM aeroporto
+    """
+
+PARTIDAS = """
+    /* lista_voo */
+    SELECT no_serie, hora_partida, chegada
+    FROM voo
+    WHERE partida = %(partida)s
+      AND hora_partida BETWEEN %(now)s AND %(later)s
+    ORDER BY hora_partida;
+    """
+
+# Listagens paginadas por keyset: cada página começa depois da chave da última
+# linha da anterior (?depois=), por isso o custo não cresce com o número da
+# página como com OFFSET. Percorre idx_voo_partida por ordem.
+LISTA_PARTIDAS = """
+    /* lista_partidas */
+    SELECT id, no_serie, hora_partida, hora_chegada, chegada
+    FROM voo
+    WHERE partida = %(partida)s
+      AND hora_partida >= %(desde)s AND hora_partida < %(ate)s
+      AND (hora_partida, id) > (%(hora_partida)s, %(id)s)
+    ORDER BY hora_partida, id
+    LIMIT %(limite)s
+    """
+
+# Só os bilhetes de uma venda do NIF dado (idx_bilhete_reserva)
+LISTA_BILHETES_RESERVA = """
+    /* lista_bilhetes_reserva */
+    SELECT b.id, b.voo_id, b.nome_passegeiro, b.preco, b.prim_classe, b.lugar
+    FROM bilhete b
+    JOIN venda v ON v.codigo_reserva = b.codigo_reserva
+    WHERE b.codigo_reserva = %(reserva)s
+      AND v.nif_cliente = %(nif)s
+      AND b.id > %(id)s
+    ORDER BY b.id
+    LIMIT %(limite)s
+    """
+
+LISTA_BILHETES_VOO = """
+    /* lista_bilhetes_voo */
+    SELECT id, codigo_reserva, nome_passegeiro, preco, prim_classe, lugar
+    FROM bilhete
+    WHERE voo_id = %(voo)s
+      AND id > %(id)s
+    ORDER BY id
+    LIMIT %(limite)s
+    """
+
+# Percorre idx_voo_rota por ordem de hora_partida e lê os lugares livres de
+# capacidade_voo, parando nos três primeiros voos
+ROTA = """
+    /* list_flights */
+    SELECT v.no_serie, v.hora_partida, v.id AS voo, l.livres_1c, l.livres_2c
+    FROM voo v
+    CROSS JOIN LATERAL (
+        SELECT SUM(c.lugares - c.vendidos) FILTER (WHERE c.prim_classe) AS livres_1c,
+               SUM(c.lugares - c.vendidos) FILTER (WHERE NOT c.prim_classe) AS livres_2c
+        FROM capacidade_voo c
+        WHERE c.voo_id = v.id
+    ) l
+    WHERE v.partida = %(partida)s
+      AND v.chegada = %(chegada)s
+      AND v.hora_partida > %(now)s
+      AND ((%(prim_classe)s::boolean IS NOT FALSE AND l.livres_1c > 0)
+        OR (%(prim_classe)s::boolean IS NOT TRUE AND l.livres_2c > 0))
+    ORDER BY v.hora_partida
+    LIMIT 3;
+    """
+
+# Todos os lugares do avião do voo, com a fila e a letra, e se já têm bilhete
+# (idx_assento_aviao e o UNIQUE (voo_id, lugar) de bilhete)
+ASSENTOS_VOO = """
+    /* assentos_voo */
+    SELECT a.prim_classe, substring(a.lugar, '^[0-9]+')::integer AS fila, right(a.lugar, 1) AS letra,
+           b.lugar IS NOT NULL AS ocupado
+    FROM voo v
+    JOIN assento a ON a.no_serie = v.no_serie
+    LEFT JOIN bilhete b ON b.voo_id = v.id AND b.lugar = a.lugar
+    WHERE v.id = %(voo)s
+    """
+
+VOOS_COMPRA = """
+    /* compra:voos */
+    SELECT id, no_serie, hora_partida
+    FROM voo
+    WHERE id = ANY(%(voos)s)
+    """
+
+VENDA = """
+    /* compra:venda */
+    WITH nova_venda AS (
+        INSERT INTO venda (nif_cliente, balcao, hora)
+        VALUES (%(nif_cliente)s, NULL, %(hora)s)
+        RETURNING codigo_reserva
+    )
+    INSERT INTO bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe, lugar, no_serie)
+    SELECT b.voo_id, nova_venda.codigo_reserva, b.nome_passegeiro, b.preco, b.prim_classe, NULL, b.no_serie
+    FROM nova_venda,
+         unnest(%(voo_ids)s::integer[], %(nomes)s::varchar[], %(precos)s::numeric[],
+                %(prim_classes)s::boolean[], %(no_series)s::varchar[])
+             AS b(voo_id, nome_passegeiro, preco, prim_classe, no_serie)
+    RETURNING id, voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe
+    """
+
+# FOR UPDATE: dois check-ins do mesmo bilhete ficam em fila
+BILHETE_CHECKIN = """
+    /* checkin:bilhete */
+    SELECT voo_id, prim_classe, no_serie
+    FROM bilhete
+    WHERE id = %(bilhete)s AND lugar IS NULL
+    FOR UPDATE
+    """
+
+# Antes de ATRIBUIR_LUGAR, numa instrução à parte: um check-in de cada vez em
+# cada classe de cada voo. As linhas de assento não servem para isto: são do
+# avião, e um lugar ocupado num voo está livre nos outros voos do mesmo avião.
+# À espera aqui, o check-in seguinte lê já o lugar do anterior; os voos e as
+# classes diferentes não esperam uns pelos outros. Os check-ins em lote pedem o
+# mesmo bloqueio (CHECKIN_BLOQUEIO).
+CHECKIN_CLASSE_BLOQUEIO = """
+    /* checkin:bloqueio */
+    SELECT pg_advisory_xact_lock(hashtext('checkin:' || %(prim_classe)s::text), %(voo_id)s::integer)
+    """
+
+# Escolhe e atribui o lugar numa só instrução, depois de CHECKIN_CLASSE_BLOQUEIO.
+# O UNIQUE (voo_id, lugar) apanha o caso raro de o lugar ter sido confirmado
+# por quem não pediu o bloqueio (p.ex. um bilhete que mudou de classe).
+ATRIBUIR_LUGAR = """
+    /* checkin:lugar */
+    WITH livre AS (
+        SELECT a.lugar
+        FROM assento a
+        WHERE a.no_serie = %(no_serie)s
+          AND a.prim_classe = %(prim_classe)s
+          AND NOT EXISTS (
+              SELECT 1
+              FROM bilhete b
+              WHERE b.voo_id = %(voo_id)s
+                AND b.lugar = a.lugar
+          )
+        ORDER BY a.lugar
+        LIMIT 1
+    )
+    UPDATE bilhete
+    SET lugar = livre.lugar
+    FROM livre
+    WHERE id = %(bilhete)s
+    RETURNING bilhete.lugar
+    """
+
+# Check-in em lote: todos os bilhetes sem lugar de uma reserva ou de um voo
+# numa só instrução (depois de CHECKIN_BLOQUEIO). Os bilhetes que outro
+# check-in tem bloqueados ficam de fora (SKIP LOCKED): já estão a ser tratados,
+# e a instrução nunca espera, por isso não decide com os lugares livres de uma
+# leitura desatualizada. Os bilhetes são numerados por (voo, classe), agrupados
+# por reserva; os lugares livres da classe são numerados pela ordem abaixo e
+# cada bilhete fica com o lugar do mesmo número.
+#
+# Lugares livres seguidos numa fila formam um bloco (a letra menos a posição do
+# lugar entre os livres da fila é constante). Os lugares vêm primeiro dos
+# blocos com espaço para o grupo todo (os bilhetes do lote nesse voo e classe)
+# e, se nenhum chegar, dos maiores; entre os blocos onde cabe, do mais pequeno,
+# para não partir os grandes. Uma reserva fica lado a lado sempre que há um
+# bloco onde caiba; no voo inteiro cada reserva ocupa lugares seguidos desta
+# ordem, que começa pelos blocos maiores.
+#
+# Os lugares não são bloqueados: as linhas de assento são do avião, partilhadas
+# pelos voos dele. CHECKIN_BLOQUEIO já deixou o lote sozinho nas classes dos
+# seus voos. Se um bilhete de outra classe (vendido depois do bloqueio, ou que
+# mudou de classe) confirmar um lugar escolhido entre a leitura e a
+# atribuição, o UNIQUE (voo_id, lugar) recusa o lote, que é repetido.
+CHECKIN_LOTE = """
+    /* {nome} */
+    WITH bloqueados AS (
+        SELECT b.id, b.voo_id, b.no_serie, b.prim_classe, b.codigo_reserva
+        FROM bilhete b
+        WHERE {filtro}
+          AND b.lugar IS NULL
+        FOR UPDATE SKIP LOCKED
+    ),
+    pendentes AS (
+        SELECT id, voo_id, no_serie, prim_classe,
+               row_number() OVER (PARTITION BY voo_id, prim_classe ORDER BY codigo_reserva, id) AS n,
+               count(*) OVER (PARTITION BY voo_id, prim_classe) AS grupo
+        FROM bloqueados
+    ),
+    livres AS (
+        SELECT c.voo_id, c.no_serie, c.prim_classe, c.grupo, a.lugar,
+               substring(a.lugar, '^[0-9]+')::integer AS fila, right(a.lugar, 1) AS letra
+        FROM (SELECT DISTINCT voo_id, no_serie, prim_classe, grupo FROM pendentes) c
+        JOIN assento a ON a.no_serie = c.no_serie AND a.prim_classe = c.prim_classe
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM bilhete o
+            WHERE o.voo_id = c.voo_id
+              AND o.lugar = a.lugar
+        )
+    ),
+    blocos AS (
+        SELECT l.*, count(*) OVER (PARTITION BY voo_id, prim_classe, fila, bloco) AS tamanho
+        FROM (
+            SELECT livres.*,
+                   ascii(letra) - row_number() OVER (PARTITION BY voo_id, prim_classe, fila ORDER BY letra) AS bloco
+            FROM livres
+        ) l
+    ),
+    -- MATERIALIZED: calculados uma vez, não uma por bilhete
+    escolhidos AS MATERIALIZED (
+        SELECT voo_id, prim_classe, lugar,
+               row_number() OVER (PARTITION BY voo_id, prim_classe
+                                  ORDER BY least(tamanho, grupo) DESC, tamanho, fila, letra) AS n
+        FROM blocos
+    ),
+    atribuidos AS (
+        UPDATE bilhete b
+        SET lugar = e.lugar
+        FROM pendentes p
+        JOIN escolhidos e USING (voo_id, prim_classe, n)
+        WHERE b.id = p.id
+        RETURNING b.id, b.lugar
+    )
+    SELECT p.id, p.voo_id, a.lugar
+    FROM pendentes p
+    LEFT JOIN atribuidos a USING (id)
+    ORDER BY p.id
+    """
+
+# Antes de CHECKIN_LOTE, numa instrução à parte: o bloqueio de
+# CHECKIN_CLASSE_BLOQUEIO em cada classe dos voos do lote, por ordem de
+# (voo_id, prim_classe) (sem deadlocks). Os lotes e os check-ins individuais
+# na mesma classe do mesmo voo escolheriam os mesmos lugares; à espera aqui, o
+# lote lê já os lugares dos anteriores. Os outros voos do avião não esperam.
+CHECKIN_BLOQUEIO = """
+    /* {nome}_bloqueio */
+    SELECT pg_advisory_xact_lock(hashtext('checkin:' || prim_classe::text), voo_id)
+    FROM (
+        SELECT DISTINCT b.voo_id, b.prim_classe
+        FROM bilhete b
+        WHERE {filtro}
+          AND b.lugar IS NULL
+        ORDER BY b.voo_id, b.prim_classe
+    ) v
+    """
+
+# Só os bilhetes de uma venda do cliente (?nif=)
+FILTRO_RESERVA = """b.codigo_reserva = %(reserva)s
+          AND EXISTS (SELECT 1 FROM venda v WHERE v.codigo_reserva = b.codigo_reserva AND v.nif_cliente = %(nif)s)"""
+FILTRO_VOO = "b.voo_id = %(voo)s"
+
+CHECKIN_RESERVA = CHECKIN_LOTE.format(nome="checkin:reserva", filtro=FILTRO_RESERVA)
+CHECKIN_RESERVA_BLOQUEIO = CHECKIN_BLOQUEIO.format(nome="checkin:reserva", filtro=FILTRO_RESERVA)
+CHECKIN_VOO = CHECKIN_LOTE.format(nome="checkin:voo", filtro=FILTRO_VOO)
+CHECKIN_VOO_BLOQUEIO = CHECKIN_BLOQUEIO.format(nome="checkin:voo", filtro=FILTRO_VOO)
+
+# Quando o lote não tem bilhetes: distingue "nada por fazer" (200) de "não existe" (404)
+RESERVA_CLIENTE = """
+    /* checkin:reserva_cliente */
+    SELECT 1 FROM venda WHERE codigo_reserva = %(reserva)s AND nif_cliente = %(nif)s
+    """
+
+VOO_EXISTE = "/* checkin:voo_existe */ SELECT 1 FROM voo WHERE id = %(voo)s"
+
+# Com voo, venda e bilhete particionados por mês (particoes.sql) os bilhetes
+# levam as chaves de partição (a hora_partida do voo e a hora da venda), e as
+# leituras dos bilhetes de um voo dizem a hora_partida, para o plano só ler a
+# partição desse mês em vez de procurar o voo_id em todas. registo.py usa-as
+# no lugar das de cima quando bilhete é particionado.
+VENDA_PARTICOES = """
+    /* compra:venda */
+    WITH nova_venda AS (
+        INSERT INTO venda (nif_cliente, balcao, hora)
+        VALUES (%(nif_cliente)s, NULL, %(hora)s)
+        RETURNING codigo_reserva, hora
+    )
+    INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, hora_venda, nome_passegeiro, preco, prim_classe,
+                         lugar, no_serie)
+    SELECT b.voo_id, b.hora_partida, nova_venda.codigo_reserva, nova_venda.hora, b.nome_passegeiro, b.preco,
+           b.prim_classe, NULL, b.no_serie
+    FROM nova_venda,
+         unnest(%(voo_ids)s::integer[], %(horas_partida)s::timestamp[], %(nomes)s::varchar[], %(precos)s::numeric[],
+                %(prim_classes)s::boolean[], %(no_series)s::varchar[])
+             AS b(voo_id, hora_partida, nome_passegeiro, preco, prim_classe, no_serie)
+    RETURNING id, voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe
+    """
+
+# A hora_partida vem de uma subconsulta, calculada antes de o plano abrir as
+# partições de bilhete; com b.hora_partida = v.hora_partida o planeador junta
+# com um hash join e lê-as todas
+ASSENTOS_VOO_PARTICOES = """
+    /* assentos_voo */
+    SELECT a.prim_classe, substring(a.lugar, '^[0-9]+')::integer AS fila, right(a.lugar, 1) AS letra,
+           b.lugar IS NOT NULL AS ocupado
+    FROM voo v
+    JOIN assento a ON a.no_serie = v.no_serie
+    LEFT JOIN bilhete b ON b.voo_id = v.id
+                       AND b.hora_partida = (SELECT hora_partida FROM voo WHERE id = %(voo)s)
+                       AND b.lugar = a.lugar
+    WHERE v.id = %(voo)s
+    """
+
+LISTA_BILHETES_VOO_PARTICOES = """
+    /* lista_bilhetes_voo */
+    SELECT id, codigo_reserva, nome_passegeiro, preco, prim_classe, lugar
+    FROM bilhete
+    WHERE voo_id = %(voo)s
+      AND hora_partida = (SELECT hora_partida FROM voo WHERE id = %(voo)s)
+      AND id > %(id)s
+    ORDER BY id
+    LIMIT %(limite)s
+    """
+
+FILTRO_VOO_PARTICOES = """b.voo_id = %(voo)s
+          AND b.hora_partida = (SELECT hora_partida FROM voo WHERE id = %(voo)s)"""
+
+CHECKIN_VOO_PARTICOES = CHECKIN_LOTE.format(nome="checkin:voo", filtro=FILTRO_VOO_PARTICOES)
+CHECKIN_VOO_BLOQUEIO_PARTICOES = CHECKIN_BLOQUEIO.format(nome="checkin:voo", filtro=FILTRO_VOO_PARTICOES)
+
+
+# Linhas por página das listagens (?limite=) e por ida ao cursor do servidor
+LIMITE_LISTAGEM = 1000
+LIMITE_LISTAGEM_MAXIMO = 100000
+LOTE_LISTAGEM = 500
+
+
+class ErroCompra(Exception):
+    """pedido de compra recusado; desfaz a transação da venda"""
+
+    def __init__(self, mensagem, estado):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.estado = estado
+
+
+def ler_nif(corpo):
+    if not isinstance(corpo, dict):
+        raise ErroCompra("Pedido invalido", 400)
+    nif_cliente = corpo.get("nif")
+    if not isinstance(nif_cliente, str) or len(nif_cliente) != 9:
+        raise ErroCompra("Nif tem que ter 9 numeros", 400)
+    return nif_cliente
+
+
+def ler_passageiros(ticket_pairs):
+    """valida os pares nome -> primeira classe de um pedido de compra"""
+
+    if not ticket_pairs or not isinstance(ticket_pairs, dict):
+        return None
+    for nome_passegeiro, primeira_classe in ticket_pairs.items():
+        if not isinstance(nome_passegeiro, str) or not isinstance(primeira_classe, bool):
+            return None
+    return list(ticket_pairs.items())
+
+
+def ler_compra(corpo, voo):
+    """(nif, pernas) de um pedido a /compra/<voo>"""
+
+    nif_cliente = ler_nif(corpo)
+    passageiros = ler_passageiros(corpo.get("ticket-pairs"))
+    if passageiros is None:
+        raise ErroCompra("Lista de passageiros vazia ou invalida", 400)
+    return nif_cliente, [(voo, passageiros)]
+
+
+def ler_itinerario(corpo):
+    """(nif, pernas) de um pedido a /compra com vários voos"""
+
+    nif_cliente = ler_nif(corpo)
+
+    pernas = corpo.get("voos")
+    if not pernas or not isinstance(pernas, list):
+        raise ErroCompra("Lista de voos vazia", 400)
+
+    itinerario = []
+    for perna in pernas:
+        voo = perna.get("voo") if isinstance(perna, dict) else None
+        passageiros = ler_passageiros(perna.get("ticket-pairs")) if isinstance(perna, dict) else None
+        if not isinstance(voo, int) or isinstance(voo, bool) or passageiros is None:
+            raise ErroCompra("Dados do itinerario invalidos", 400)
+        # Cada voo numa só perna: o mesmo passageiro em duas pernas do voo violava o UNIQUE de bilhete
+        if any(voo == anterior for anterior, _ in itinerario):
+            raise ErroCompra("Dados do itinerario invalidos", 400)
+        itinerario.append((voo, passageiros))
+    return nif_cliente, itinerario
+
+
+def parametros_venda(voos, nif_cliente, pernas):
+    """parâmetros de VENDA para as pernas pedidas
+
+    voos são as linhas de VOOS_COMPRA. Lança ErroCompra se algum voo não
+    existir ou já tiver partido.
+    """
+
+    voos = {v.id: v for v in voos}
+
+    agora = datetime.now()
+    for voo, _ in pernas:
+        if voo not in voos:
+            raise ErroCompra(f"Voo {voo} nao existe", 404)
+        if voos[voo].hora_partida < agora:
+            raise ErroCompra(f"Voo {voo} ja partiu", 400)
+
+    voo_ids, horas_partida, nomes, precos, prim_classes, no_series = [], [], [], [], [], []
+    for voo, passageiros in pernas:
+        for nome_passegeiro, primeira_classe in passageiros:
+            voo_ids.append(voo)
+            horas_partida.append(voos[voo].hora_partida)
+            nomes.append(nome_passegeiro)
+            precos.append(random.randint(50, 500))
+            prim_classes.append(primeira_classe)
+            no_series.append(voos[voo].no_serie)
+
+    return {
+        "nif_cliente": nif_cliente,
+        "hora": agora.strftime("%Y-%m-%d %H:%M:%S"),
+        "voo_ids": voo_ids,
+        # só para VENDA_PARTICOES; VENDA ignora-as
+        "horas_partida": horas_partida,
+        "nomes": nomes,
+        "precos": precos,
+        "prim_classes": prim_classes,
+        "no_series": no_series,
+    }
+
+
+def resposta_venda(bilhetes):
+    """corpo da resposta 201 a partir das linhas devolvidas por VENDA"""
+
+    return {
+        "message": "Compra realizada com sucesso.",
+        "status": "success",
+        "codigo_reserva": bilhetes[0].codigo_reserva,
+        "bilhetes": [
+            {
+                "id": b.id,
+                "voo": b.voo_id,
+                "nome_passegeiro": b.nome_passegeiro,
+                "preco": b.preco,
+                "prim_classe": b.prim_classe,
+            }
+            for b in sorted(bilhetes, key=lambda b: b.id)
+        ],
+    }
+
+
+def resposta_checkin(linhas):
+    """corpo da resposta a um check-in em lote, a partir das linhas de CHECKIN_RESERVA ou CHECKIN_VOO
+
+    Os bilhetes para os quais não havia lugar na classe vêm com "lugar": null.
+    """
+
+    sem_lugar = sum(1 for linha in linhas if linha.lugar is None)
+    if not linhas:
+        mensagem = "Nenhum bilhete por fazer check-in"
+    elif sem_lugar:
+        mensagem = "Check-in realizado; não há lugares disponíveis para alguns bilhetes"
+    else:
+        mensagem = "Check-in realizado com sucesso"
+    return {
+        "message": mensagem,
+        "status": "success",
+        "sem_lugar": sem_lugar,
+        "bilhetes": [{"id": linha.id, "voo": linha.voo_id, "lugar": linha.lugar} for linha in linhas],
+    }
+
+
+def mapa_assentos(linhas):
+    """mapa de lugares de um voo a partir das linhas de ASSENTOS_VOO, por classe
+
+    Cada classe ocupa as filas [primeira, última] com as letras dadas; "ocupados"
+    é um bitmap em hexadecimal, fila a fila e letra a letra, com o bit mais
+    significativo primeiro e 1 nos lugares ocupados. As posições da grelha que
+    não são lugares do avião (em "sem_assento") também vão a 1.
+    """
+
+    por_classe = {}
+    for linha in linhas:
+        por_classe.setdefault(linha.prim_classe, {})[(linha.fila, linha.letra)] = linha.ocupado
+
+    classes = {}
+    for nome, prim_classe in CLASSES.items():
+        lugares = por_classe.get(prim_classe)
+        if nome is None or not lugares:
+            continue
+        filas = range(min(f for f, _ in lugares), max(f for f, _ in lugares) + 1)
+        letras = "".join(sorted({letra for _, letra in lugares}))
+        grelha = [(fila, letra) for fila in filas for letra in letras]
+        digitos = (len(grelha) + 3) // 4
+        bits = 0
+        for i, posicao in enumerate(grelha):
+            if lugares.get(posicao, True):
+                bits |= 1 << (digitos * 4 - 1 - i)
+        classes[nome] = {
+            "filas": [filas.start, filas.stop - 1],
+            "letras": letras,
+            "lugares": len(lugares),
+            "livres": sum(1 for ocupado in lugares.values() if not ocupado),
+            "ocupados": f"{bits:0{digitos}x}",
+            "sem_assento": [f"{fila}{letra}" for fila, letra in grelha if (fila, letra) not in lugares],
+        }
+    return classes
+
+
+def codificar_cursor(chave):
+    """cursor opaco (?depois=) com a chave da última linha enviada"""
+
+    texto = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in chave])
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def ler_cursor(cursor, tipos):
+    """chave guardada por codificar_cursor(); tipos são os tipos de cada coluna (datetime ou int)
+
+    Lança ValueError se o cursor não for válido.
+    """
+
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(valores, list) or len(valores) != len(tipos):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(v) if tipo is datetime else tipo(v) for tipo, v in zip(tipos, valores)
+        )
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("depois must be a cursor returned by a previous page.") from None
+
+
+def ler_limite(valor):
+    """?limite= de uma listagem (None: LIMITE_LISTAGEM); lança ValueError se estiver fora dos limites"""
+
+    limite = LIMITE_LISTAGEM if valor is None else valor
+    if not 1 <= limite <= LIMITE_LISTAGEM_MAXIMO:
+        raise ValueError(f"limite must be between 1 and {LIMITE_LISTAGEM_MAXIMO}.")
+    return limite
+
+
+def parametros_partidas(partida, args):
+    """parâmetros de LISTA_PARTIDAS a partir de ?desde=&ate=&limite=&depois=
+
+    desde e ate são dias (AAAA-MM-DD, ambos incluídos); por omissão, só hoje.
+    Lança ValueError se algum for inválido.
+    """
+
+    try:
+        desde = date.fromisoformat(args["desde"]) if args.get("desde") else date.today()
+        ate = date.fromisoformat(args["ate"]) if args.get("ate") else desde
+    except ValueError:
+        raise ValueError("desde and ate must be dates (YYYY-MM-DD).") from None
+    if ate < desde:
+        raise ValueError("ate must not be before desde.")
+
+    desde = datetime.combine(desde, datetime.min.time())
+    hora_partida, voo = ler_cursor(args["depois"], (datetime, int)) if args.get("depois") else (desde, 0)
+    return {
+        "partida": partida,
+        "desde": desde,
+        "ate": datetime.combine(ate + timedelta(days=1), datetime.min.time()),
+        "hora_partida": hora_partida,
+        "id": voo,
+        "limite": ler_limite(args.get("limite", type=int)),
+    }
+
+
+def parametros_bilhetes(args, **parametros):
+    """parâmetros das listagens de bilhetes (keyset por id) a partir de ?limite=&depois="""
+
+    (bilhete,) = ler_cursor(args["depois"], (int,)) if args.get("depois") else (0,)
+    return {**parametros, "id": bilhete, "limite": ler_limite(args.get("limite", type=int))}
+
+
+def parametros_reserva(reserva, args):
+    """parâmetros de LISTA_BILHETES_RESERVA; ?nif= tem de ser o NIF da venda"""
+
+    try:
+        nif = ler_nif(args)
+    except ErroCompra as e:
+        raise ValueError(e.mensagem) from None
+    return parametros_bilhetes(args, reserva=reserva, nif=nif)
+
+
+class ListagemJSON:
+    """escreve uma listagem como JSON aos bocados: {"itens": [...], "seguinte": cursor ou null}
+
+    Recebe as linhas (tuplos) em lotes e devolve os bytes de cada lote, sem
+    nunca guardar a listagem inteira; colunas converte cada linha num
+    dicionário (ver serializacao.Colunas) e dumps escreve uma lista delas.
+    "seguinte" só vem preenchido se a página ficou cheia, com o cursor da última
+    linha; chave são as colunas do keyset.
+    """
+
+    def __init__(self, chave, limite, colunas, dumps):
+        self.chave = [colunas.nomes.index(coluna) for coluna in chave]
+        self.limite = limite
+        self.colunas = colunas
+        self.dumps = dumps
+        self.linhas = 0
+        self.ultima = None
+
+    def inicio(self):
+        return b'{"itens":['
+
+    def lote(self, linhas):
+        if not linhas:
+            return b""
+        # Um só dumps por lote, sem os [ ] da lista
+        texto = self.dumps([self.colunas(linha) for linha in linhas])[1:-1]
+        if self.linhas:
+            texto = b"," + texto
+        self.linhas += len(linhas)
+        self.ultima = linhas[-1]
+        return texto
+
+    def fim(self):
+        seguinte = None
+        if self.linhas >= self.limite:
+            seguinte = codificar_cursor([self.ultima[i] for i in self.chave])
+        return f'],"seguinte":{json.dumps(seguinte)}}}'.encode()
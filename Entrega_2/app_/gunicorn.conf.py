@@ -0,0 +1,51 @@
+"""Configuração do gunicorn, lida automaticamente quando é lançado nesta pasta (start, Procfile)."""
+import os
+import shutil
+import sys
+import tempfile
+
+# Cada worker escreve as suas métricas nesta pasta e /metrics soma-as (ver
+# metricas.py). Tem de estar definida antes de os workers importarem o
+# prometheus_client, e é limpa a cada arranque para não somar valores antigos.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "aviacao-metricas")
+)
+shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+
+# Workers com threads: cada pedido ocupa uma thread e, enquanto corre, uma
+# ligação do pool do seu worker, por isso o worker tem tantas threads como
+# ligações (POOL_MAX em app.py) e nenhum pedido espera por uma ligação. Ao
+# todo são workers × POOL_MAX ligações, que têm de caber no max_connections
+# do PostgreSQL (100 por omissão), com as do agregados.py e do psql.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("POOL_MAX", 10))
+
+# Com o preload a aplicação é importada uma vez no master e os workers nascem
+# já com ela carregada (arrancam mais depressa e partilham a memória). Os pools
+# são criados fechados e só abrem em cada worker, em post_worker_init, por isso
+# nenhum socket do PostgreSQL passa pelo fork. GUNICORN_PRELOAD=0 desliga-o,
+# p.ex. para o --reload em desenvolvimento.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def child_exit(server, worker):
+    # Os gauges de um worker que morreu deixam de contar
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # O pool liga-se em segundo plano enquanto o worker já aceita pedidos; o /ready diz quando acabou
+    app = sys.modules.get("app")
+    if hasattr(app, "abrir_pools"):
+        app.abrir_pools()
+
+
+def worker_exit(server, worker):
+    # Fecha as ligações em vez de as deixar cair com o processo
+    app = sys.modules.get("app")
+    if hasattr(app, "fechar_pools"):
+        app.fechar_pools()
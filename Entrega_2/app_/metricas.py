@@ -0,0 +1,147 @@
+"""Métricas Prometheus da API (endpoint /metrics de app.py).
+
+Por pedido regista-se a duração total, o tempo à espera de uma ligação do
+pool e o tempo com a ligação na mão (SQL), por rota, e o código de estado de
+cada resposta. Dos pools (o do primário e o da réplica, se houver) são exportadas
+as estatísticas do psycopg_pool.
+
+Com o gunicorn cada worker é um processo com o seu pool e as suas métricas;
+gunicorn.conf.py define PROMETHEUS_MULTIPROC_DIR e o prometheus_client guarda
+os valores de todos os workers em ficheiros nessa pasta, que /metrics soma.
+Sem essa variável (flask run) as métricas são só as do processo.
+"""
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from psycopg_pool import ConnectionPool
+
+# Intervalo mínimo entre leituras das estatísticas do pool em cada worker
+POOL_INTERVALO = 1.0
+
+# Os pedidos desta API demoram milissegundos; os buckets por defeito começam em 5 ms
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PEDIDO = Histogram("aviacao_pedido_segundos", "Duração dos pedidos", ["rota"], buckets=BUCKETS)
+ESPERA_POOL = Histogram(
+    "aviacao_pool_espera_segundos", "Tempo à espera de uma ligação do pool, por pedido", ["rota"], buckets=BUCKETS
+)
+SQL = Histogram("aviacao_sql_segundos", "Tempo com a ligação do pool em uso, por pedido", ["rota"], buckets=BUCKETS)
+RESPOSTAS = Counter("aviacao_respostas", "Respostas por rota e código de estado", ["rota", "estado"])
+
+# Estatísticas do psycopg_pool: os valores instantâneos somam-se pelos workers
+# vivos, os contadores acumulam os deltas de get_stats() (pop_stats() poria a
+# zero os contadores que o /ready também lê, ver prontidao.py)
+POOL_ESTADO = {
+    "pool_size": Gauge("psycopg_pool_size", "Ligações abertas", ["pool"], multiprocess_mode="livesum"),
+    "pool_available": Gauge("psycopg_pool_available", "Ligações livres", ["pool"], multiprocess_mode="livesum"),
+    "pool_max": Gauge("psycopg_pool_max", "Máximo de ligações", ["pool"], multiprocess_mode="livesum"),
+    "requests_waiting": Gauge(
+        "psycopg_pool_requests_waiting", "Pedidos à espera de uma ligação", ["pool"], multiprocess_mode="livesum"
+    ),
+}
+POOL_CONTADORES = {
+    "requests_num": Counter("psycopg_pool_requests", "Ligações pedidas ao pool", ["pool"]),
+    "requests_queued": Counter("psycopg_pool_requests_queued", "Pedidos que tiveram de esperar", ["pool"]),
+    "requests_errors": Counter("psycopg_pool_requests_errors", "Pedidos sem ligação (timeout)", ["pool"]),
+    "connections_num": Counter("psycopg_pool_connections", "Ligações abertas ao servidor", ["pool"]),
+    "connections_errors": Counter("psycopg_pool_connections_errors", "Falhas a abrir ligações", ["pool"]),
+    "connections_lost": Counter("psycopg_pool_connections_lost", "Ligações perdidas", ["pool"]),
+}
+POOL_ESPERA = Counter("psycopg_pool_requests_wait_seconds", "Tempo total à espera de ligações", ["pool"])
+
+# Últimos valores dos contadores de cada pool, para exportar só os deltas
+anteriores = {}
+anteriores_lock = threading.Lock()
+
+
+class ConnectionPoolMedido(ConnectionPool):
+    """ConnectionPool que conta, no pedido Flask em curso, a espera e o uso das ligações."""
+
+    def getconn(self, timeout=None):
+        inicio = time.perf_counter()
+        try:
+            conn = super().getconn(timeout)
+        finally:
+            if has_request_context():
+                g.espera_pool = g.get("espera_pool", 0.0) + time.perf_counter() - inicio
+        if has_request_context():
+            g.setdefault("ligacoes", {})[id(conn)] = time.perf_counter()
+        return conn
+
+    def putconn(self, conn):
+        if has_request_context() and (inicio := g.get("ligacoes", {}).pop(id(conn), None)) is not None:
+            g.sql = g.get("sql", 0.0) + time.perf_counter() - inicio
+        super().putconn(conn)
+
+
+def atualizar_pool(pool):
+    """copia as estatísticas do pool para as métricas deste worker"""
+
+    with anteriores_lock:
+        stats = pool.get_stats()
+        antes = anteriores.get(pool.name, {})
+        anteriores[pool.name] = stats
+    for nome, gauge in POOL_ESTADO.items():
+        gauge.labels(pool.name).set(stats.get(nome, 0))
+    for nome, contador in POOL_CONTADORES.items():
+        if delta := stats.get(nome, 0) - antes.get(nome, 0):
+            contador.labels(pool.name).inc(delta)
+    if delta := stats.get("requests_wait_ms", 0) - antes.get("requests_wait_ms", 0):
+        POOL_ESPERA.labels(pool.name).inc(delta / 1000)
+
+
+def instrumentar(app, *pools):
+    """regista os hooks que medem cada pedido de `app` e exportam as estatísticas de `pools`"""
+
+    # labels() custa tanto como observe(); as séries de cada rota ficam guardadas
+    series = {}
+    proxima = [0.0]
+
+    @app.before_request
+    def iniciar_medicao():
+        g.inicio_pedido = time.perf_counter()
+
+    @app.after_request
+    def registar_medicao(resposta):
+        fim = time.perf_counter()
+        rota = request.url_rule.rule if request.url_rule else "sem_rota"
+        chave = (rota, resposta.status_code)
+        if chave not in series:
+            series[chave] = (
+                PEDIDO.labels(rota),
+                ESPERA_POOL.labels(rota),
+                SQL.labels(rota),
+                RESPOSTAS.labels(rota, str(resposta.status_code)),
+            )
+        pedido, espera_pool, sql, respostas = series[chave]
+
+        medidas = g.__dict__
+        if "inicio_pedido" in medidas:
+            pedido.observe(fim - medidas["inicio_pedido"])
+        if "espera_pool" in medidas:
+            espera_pool.observe(medidas["espera_pool"])
+            sql.observe(medidas.get("sql", 0.0))
+        respostas.inc()
+
+        if fim >= proxima[0]:
+            proxima[0] = fim + POOL_INTERVALO
+            for pool in pools:
+                atualizar_pool(pool)
+        return resposta
+
+
+def exportar(*pools):
+    """(corpo, content type) da resposta a /metrics"""
+
+    for pool in pools:
+        atualizar_pool(pool)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,68 @@
+"""Prontidão dos pools de ligações, para o /ready
+
+Os pools são criados fechados e abertos em cada processo depois do fork (ver
+abrir_pools() em app.py e gunicorn.conf.py). open() não espera pelas
+ligações: o pool liga-se em segundo plano e corre o hook configure
+(registo.preparar) em cada ligação nova, antes de a pôr no pool.
+
+O estado vem de pool.get_stats(), lido em cada /ready:
+
+- o pool aquece quando tem min_size ligações livres (pool_available), já
+  preparadas; até lá o primeiro pedido ainda podia esperar por uma ligação e
+  pelo PREPARE das consultas frequentes;
+- deixa de estar pronto, e tem de voltar a aquecer, quando desde o último
+  /ready houve pedidos sem ligação (requests_errors), ligações perdidas ou
+  devolvidas partidas (connections_lost, returns_bad, p.ex. depois de o
+  PostgreSQL reiniciar) ou falhas a ligar (connections_errors), ou quando
+  pool_size fica abaixo de min_size (o pool desistiu de repor ligações);
+- depois de aquecido, as ligações renovadas por max_lifetime ou em uso pelos
+  pedidos não contam contra ele.
+
+Uma ligação partida que está livre no pool só se descobre quando é usada; o
+/ready não faz consultas.
+
+O /ping diz só que o processo responde (liveness); o /ready diz se já vale a
+pena mandar-lhe tráfego (readiness, p.ex. num load balancer ou no Kubernetes).
+Com o gunicorn cada pedido vai a um worker, que responde pelos seus pools.
+"""
+import threading
+
+# Contadores de get_stats() que tiram a prontidão a um pool
+ERROS = ("requests_errors", "connections_lost", "returns_bad", "connections_errors")
+
+
+class Prontidao:
+    """guarda, por pool, os contadores de erros do último /ready e se o pool já aqueceu"""
+
+    def __init__(self):
+        self.erros = {}
+        self.aquecidos = set()
+        self.lock = threading.Lock()
+
+    def estado_pool(self, p):
+        stats = p.get_stats()
+        erros = {nome: stats.get(nome, 0) for nome in ERROS}
+        aberto = not p.closed
+        with self.lock:
+            antes = self.erros.get(p.name, {})
+            self.erros[p.name] = erros
+            novos = {nome: n - antes.get(nome, 0) for nome, n in erros.items() if n > antes.get(nome, 0)}
+            if not aberto or novos or stats.get("pool_size", 0) < p.min_size:
+                self.aquecidos.discard(p.name)
+            elif stats.get("pool_available", 0) >= p.min_size:
+                self.aquecidos.add(p.name)
+            pronto = p.name in self.aquecidos
+        return {
+            "aberto": aberto,
+            "min_size": p.min_size,
+            "ligacoes": stats.get("pool_size", 0),
+            "ligacoes_livres": stats.get("pool_available", 0),
+            "erros": novos,
+            "pronto": pronto,
+        }
+
+    def estado(self, pools):
+        """(pronto, estado de cada pool) dos pools dados"""
+
+        estado = {p.name: self.estado_pool(p) for p in pools}
+        return all(e["pronto"] for e in estado.values()), estado
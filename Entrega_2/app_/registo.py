@@ -0,0 +1,189 @@
+"""Registo central das consultas da API, executadas pelo nome.
+
+Os handlers de app.py e app_async.py não executam SQL diretamente: chamam
+executar() com o nome da consulta (o da etiqueta /* ... */, ver consultas.py),
+que mede o tempo e as linhas de cada execução (métricas aviacao_consulta_*).
+
+As consultas frequentes (o painel de partidas, a pesquisa de voos, o mapa de
+lugares, a compra e o check-in) são preparadas no servidor desde a primeira
+execução em cada ligação, em vez de só à quinta (prepare_threshold do psycopg).
+preparar() é o hook configure do pool: prepara-as logo quando a ligação é
+criada, com parâmetros que não devolvem nem alteram linhas, para que nenhum
+pedido pague o parse e o plano. A venda insere sempre uma linha e só é preparada no primeiro
+uso.
+
+Com voo, venda e bilhete particionados (particoes.sql) algumas consultas são
+outras (PARTICOES). A aplicação vê o esquema uma vez, ao abrir os pools, e
+escolhe as consultas em uso com detetar_esquema() (EM_USO), antes de
+preparar() as preparar nas ligações novas.
+
+O psycopg identifica cada prepared statement pelo SQL e pelos tipos dos
+parâmetros, e escolhe int2, int4 ou int8 conforme o valor de cada inteiro;
+preparar() fixa int8 para todos, senão um id acima de 32767 precisaria de
+outro prepared statement.
+"""
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from prometheus_client import Counter, Histogram
+from psycopg.types.numeric import Int8BinaryDumper, Int8Dumper
+
+import consultas
+from metricas import BUCKETS
+
+CONSULTA = Histogram(
+    "aviacao_consulta_segundos", "Duração de cada execução, por consulta", ["consulta"], buckets=BUCKETS
+)
+LINHAS = Counter("aviacao_consulta_linhas", "Linhas devolvidas ou alteradas, por consulta", ["consulta"])
+
+# aquecer: parâmetros com que preparar() executa a consulta numa ligação nova
+# (um dicionário por combinação de tipos usada pelos handlers); leitura: pode
+# correr na réplica (ver replica.py)
+Consulta = namedtuple("Consulta", "sql preparar aquecer leitura", defaults=(False, (), False))
+
+EPOCA = datetime(1970, 1, 1)
+
+REGISTO = {
+    "list_aeroportos": Consulta(consultas.AEROPORTOS, True, ({},), True),
+    "lista_voo": Consulta(consultas.PARTIDAS, True, ({"partida": "", "now": EPOCA, "later": EPOCA},), True),
+    "list_flights": Consulta(
+        consultas.ROTA,
+        True,
+        tuple({"partida": "", "chegada": "", "now": EPOCA, "prim_classe": classe} for classe in (None, True)),
+        True,
+    ),
+    "assentos_voo": Consulta(consultas.ASSENTOS_VOO, True, ({"voo": 0},), True),
+    "compra:voos": Consulta(consultas.VOOS_COMPRA, True, ({"voos": [0]},)),
+    "compra:venda": Consulta(consultas.VENDA, True),
+    "checkin:bilhete": Consulta(consultas.BILHETE_CHECKIN, True, ({"bilhete": 0},)),
+    "checkin:bloqueio": Consulta(consultas.CHECKIN_CLASSE_BLOQUEIO, True, ({"voo_id": 0, "prim_classe": False},)),
+    "checkin:lugar": Consulta(
+        consultas.ATRIBUIR_LUGAR, True, ({"no_serie": "", "prim_classe": False, "voo_id": 0, "bilhete": 0},)
+    ),
+    # Check-in em lote: um pedido por reserva ou por voo, não compensa preparar logo na ligação nova
+    "checkin:reserva_bloqueio": Consulta(consultas.CHECKIN_RESERVA_BLOQUEIO, False),
+    "checkin:reserva": Consulta(consultas.CHECKIN_RESERVA, False),
+    "checkin:voo_bloqueio": Consulta(consultas.CHECKIN_VOO_BLOQUEIO, False),
+    "checkin:voo": Consulta(consultas.CHECKIN_VOO, False),
+    "checkin:reserva_cliente": Consulta(consultas.RESERVA_CLIENTE, False),
+    "checkin:voo_existe": Consulta(consultas.VOO_EXISTE, False),
+    # Lidas por cursores do servidor (DECLARE), que não usam prepared statements
+    "lista_partidas": Consulta(consultas.LISTA_PARTIDAS, leitura=True),
+    "lista_bilhetes_reserva": Consulta(consultas.LISTA_BILHETES_RESERVA, leitura=True),
+    "lista_bilhetes_voo": Consulta(consultas.LISTA_BILHETES_VOO, leitura=True),
+}
+
+# As que mudam com voo, venda e bilhete particionados (particoes.sql; ver consultas.py)
+PARTICOES = {
+    "assentos_voo": REGISTO["assentos_voo"]._replace(sql=consultas.ASSENTOS_VOO_PARTICOES),
+    "compra:venda": REGISTO["compra:venda"]._replace(sql=consultas.VENDA_PARTICOES),
+    "checkin:voo_bloqueio": REGISTO["checkin:voo_bloqueio"]._replace(sql=consultas.CHECKIN_VOO_BLOQUEIO_PARTICOES),
+    "checkin:voo": REGISTO["checkin:voo"]._replace(sql=consultas.CHECKIN_VOO_PARTICOES),
+    "lista_bilhetes_voo": REGISTO["lista_bilhetes_voo"]._replace(sql=consultas.LISTA_BILHETES_VOO_PARTICOES),
+}
+
+# As consultas que executar() e preparar() usam: as de REGISTO, com as de PARTICOES por cima se o esquema for o
+# particionado (usar_esquema)
+EM_USO = dict(REGISTO)
+
+ESQUEMA = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'bilhete'::regclass) AS particionado"
+
+# labels() custa tanto como observe(); as séries de cada consulta ficam guardadas
+SERIES = {nome: (CONSULTA.labels(nome), LINHAS.labels(nome)) for nome in REGISTO}
+
+
+def argumentos(nome, parametros):
+    consulta = EM_USO[nome]
+    return (consulta.sql, parametros, {"prepare": True} if consulta.preparar else {})
+
+
+def medir(nome, inicio, cur):
+    tempo, linhas = SERIES[nome]
+    tempo.observe(time.perf_counter() - inicio)
+    if cur is not None and cur.rowcount > 0:
+        linhas.inc(cur.rowcount)
+
+
+def executar(cur, nome, parametros=None):
+    """executa a consulta `nome` em `cur` (um cursor ou uma ligação) e mede-a; devolve o cursor"""
+
+    sql, parametros, opcoes = argumentos(nome, parametros)
+    inicio = time.perf_counter()
+    resultado = None
+    try:
+        resultado = cur.execute(sql, parametros, **opcoes)
+    finally:
+        medir(nome, inicio, resultado)
+    return resultado
+
+
+async def executar_async(cur, nome, parametros=None):
+    """executar() para cursores assíncronos"""
+
+    sql, parametros, opcoes = argumentos(nome, parametros)
+    inicio = time.perf_counter()
+    resultado = None
+    try:
+        resultado = await cur.execute(sql, parametros, **opcoes)
+    finally:
+        medir(nome, inicio, resultado)
+    return resultado
+
+
+def usar_int8(conn):
+    conn.adapters.register_dumper(int, Int8Dumper)
+    conn.adapters.register_dumper(int, Int8BinaryDumper)
+
+
+def usar_esquema(particionado):
+    """escolhe as consultas em uso: as de REGISTO, com as de PARTICOES se bilhete for particionado"""
+
+    EM_USO.update(REGISTO)
+    if particionado:
+        EM_USO.update(PARTICOES)
+
+
+def detetar_esquema(conn):
+    """vê em `conn` se bilhete é particionado e escolhe as consultas em uso; devolve o que viu"""
+
+    particionado = conn.execute(ESQUEMA).fetchone()[0]
+    usar_esquema(particionado)
+    return particionado
+
+
+async def detetar_esquema_async(conn):
+    """detetar_esquema() para ligações assíncronas"""
+
+    particionado = (await (await conn.execute(ESQUEMA)).fetchone())[0]
+    usar_esquema(particionado)
+    return particionado
+
+
+def aquecimentos(replica):
+    """(sql, parâmetros) a executar numa ligação nova; numa réplica só as leituras"""
+
+    for consulta in EM_USO.values():
+        if consulta.leitura or not replica:
+            for parametros in consulta.aquecer:
+                yield consulta.sql, parametros
+
+
+def preparar(conn, replica=False):
+    """hook configure do pool: inteiros como int8 e as consultas frequentes já preparadas
+
+    Com replica=True (pool da réplica) só prepara as leituras: numa réplica
+    até um UPDATE que não altera nada é recusado.
+    """
+
+    usar_int8(conn)
+    for sql, parametros in aquecimentos(replica):
+        conn.execute(sql, parametros, prepare=True)
+
+
+async def preparar_async(conn, replica=False):
+    """preparar() para o AsyncConnectionPool"""
+
+    usar_int8(conn)
+    for sql, parametros in aquecimentos(replica):
+        await conn.execute(sql, parametros, prepare=True)
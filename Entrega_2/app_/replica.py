@@ -0,0 +1,201 @@
+"""Leituras numa réplica da base de dados (DATABASE_READ_URL), com volta ao primário.
+
+Os handlers que só leem (/, /voos/..., as listagens e as análises de
+/admin/estatisticas) pedem a ligação a PoolLeitura.connection() em vez de ao
+pool do primário. Com uma réplica configurada a ligação vem do pool dela, com
+tamanho próprio, e as compras e os check-ins deixam de disputar as ligações do
+primário com as leituras. A leitura vai ao primário quando:
+
+- a réplica está atrasada mais de `atraso_maximo` segundos, ou não responde;
+- o pool da réplica não dá uma ligação em `espera` segundos;
+- o pedido traz o LSN de uma escrita do cliente (cookie aviacao_lsn, posto
+  pelas compras e check-ins) que a réplica ainda não reproduziu: quem acabou de
+  comprar vê sempre os seus bilhetes e os lugares que ocupou.
+
+O atraso e o LSN reproduzido são relidos da réplica no máximo a cada `ttl`
+segundos. Para ver pg_stat_wal_receiver o utilizador da réplica precisa de
+pg_read_all_stats (ou pg_monitor); sem isso o atraso é sempre a idade da última
+transação reproduzida, que também cresce quando o primário não tem escritas.
+"""
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg
+from prometheus_client import Counter, Gauge
+from psycopg_pool import PoolTimeout
+
+# Cookie com o LSN da última escrita do cliente
+COOKIE = "aviacao_lsn"
+
+ESTADO = """
+    /* replica:estado */
+    SELECT CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn()
+                    AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+               ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity')
+           END AS atraso,
+           COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::text AS lsn
+    """
+
+LSN_ESCRITA = "/* replica:lsn */ SELECT pg_current_wal_lsn()::text"
+
+LEITURAS = Counter(
+    "aviacao_leituras", "Ligações de leitura, por destino e motivo de ir ao primário", ["destino", "motivo"]
+)
+ATRASO = Gauge(
+    "aviacao_replica_atraso_segundos", "Atraso da réplica na última verificação", multiprocess_mode="livemax"
+)
+
+SERIES = {
+    motivo: LEITURAS.labels("replica" if motivo is None else "primario", motivo or "")
+    for motivo in (None, "atraso", "escrita", "pool")
+}
+
+
+def ler_lsn(texto):
+    """'16/B374D848' -> inteiro, para comparar posições do WAL"""
+
+    alto, baixo = texto.split("/")
+    return (int(alto, 16) << 32) + int(baixo, 16)
+
+
+class PoolLeitura:
+    """Dá ligações de leitura da réplica, se estiver em dia, ou do primário.
+
+    Tem o connection() de um pool, por isso serve também para VersoesDados.
+    Sem réplica todas as ligações vêm do primário.
+    """
+
+    def __init__(self, primario, replica=None, atraso_maximo=5.0, espera=0.05, ttl=1.0, apos_escrita=True):
+        self.primario = primario
+        self.replica = replica
+        self.atraso_maximo = atraso_maximo
+        self.espera = espera
+        self.ttl = ttl
+        self.apos_escrita = apos_escrita
+        self.atraso = float("inf")
+        self.reproduzido = 0
+        self.expira = 0.0
+        self.lock = threading.Lock()
+
+    def guardar_estado(self, linha):
+        if linha is None:
+            self.atraso = float("inf")
+        else:
+            self.atraso, self.reproduzido = linha[0], ler_lsn(linha[1])
+        ATRASO.set(self.atraso)
+        self.expira = time.monotonic() + self.ttl
+
+    def estado(self):
+        """(atraso em segundos, LSN reproduzido) da réplica"""
+
+        with self.lock:
+            if self.expira < time.monotonic():
+                try:
+                    with self.replica.connection(timeout=self.espera) as conn:
+                        linha = conn.execute(ESTADO).fetchone()
+                except PoolTimeout:
+                    linha = None
+                except psycopg.OperationalError:
+                    # Réplica reiniciada ou em baixo: troca já todas as ligações partidas, não uma por verificação
+                    linha = None
+                    self.replica.check()
+                self.guardar_estado(linha)
+            return self.atraso, self.reproduzido
+
+    def motivo_primario(self, estado, lsn):
+        """porque é que a leitura não pode ir à réplica (None se pode)"""
+
+        atraso, reproduzido = estado
+        if atraso > self.atraso_maximo:
+            return "atraso"
+        if lsn and self.apos_escrita:
+            try:
+                if ler_lsn(lsn) > reproduzido:
+                    return "escrita"
+            except ValueError:
+                pass  # cookie inválido: como se não houvesse
+        return None
+
+    @contextmanager
+    def connection(self, lsn=None):
+        """ligação de leitura; lsn é o da última escrita do cliente (cookie COOKIE), se houver"""
+
+        conn = None
+        if self.replica is not None:
+            motivo = self.motivo_primario(self.estado(), lsn)
+            if motivo is None:
+                try:
+                    conn = self.replica.getconn(timeout=self.espera)
+                except PoolTimeout:
+                    motivo = "pool"
+            SERIES[motivo].inc()
+
+        if conn is None:
+            with self.primario.connection() as conn:
+                yield conn
+            return
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.replica.putconn(conn)
+
+    def lsn_escrita(self, conn):
+        """LSN depois de uma escrita em `conn` (primário), para o cookie COOKIE; None sem réplica"""
+
+        if self.replica is None or not self.apos_escrita:
+            return None
+        return conn.execute(LSN_ESCRITA).fetchone()[0]
+
+
+class PoolLeituraAsync(PoolLeitura):
+    """PoolLeitura sobre AsyncConnectionPools, para app_async.py."""
+
+    def __init__(self, primario, replica=None, **kwargs):
+        super().__init__(primario, replica, **kwargs)
+        self.lock = asyncio.Lock()
+
+    async def estado(self):
+        async with self.lock:
+            if self.expira < time.monotonic():
+                try:
+                    async with self.replica.connection(timeout=self.espera) as conn:
+                        linha = await (await conn.execute(ESTADO)).fetchone()
+                except PoolTimeout:
+                    linha = None
+                except psycopg.OperationalError:
+                    linha = None
+                    await self.replica.check()
+                self.guardar_estado(linha)
+            return self.atraso, self.reproduzido
+
+    @asynccontextmanager
+    async def connection(self, lsn=None):
+        conn = None
+        if self.replica is not None:
+            motivo = self.motivo_primario(await self.estado(), lsn)
+            if motivo is None:
+                try:
+                    conn = await self.replica.getconn(timeout=self.espera)
+                except PoolTimeout:
+                    motivo = "pool"
+            SERIES[motivo].inc()
+
+        if conn is None:
+            async with self.primario.connection() as conn:
+                yield conn
+            return
+        try:
+            async with conn:
+                yield conn
+        finally:
+            await self.replica.putconn(conn)
+
+    async def lsn_escrita(self, conn):
+        if self.replica is None or not self.apos_escrita:
+            return None
+        return (await (await conn.execute(LSN_ESCRITA)).fetchone())[0]
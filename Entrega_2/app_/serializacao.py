@@ -0,0 +1,248 @@
+"""Serialização JSON das respostas (orjson) e compressão (gzip ou brotli).
+
+As linhas das consultas que vão diretas para a resposta são lidas com a row
+factory linhas_json(): dicionários coluna -> valor, já só com tipos que o
+orjson escreve sem ajuda. A conversão de cada coluna (datas em formato HTTP,
+como o Flask as escrevia, e NUMERIC em texto) é escolhida uma vez por
+consulta, a partir de cursor.description, e não valor a valor.
+
+JSONRapido substitui o json do Flask/Quart (jsonify, request.json) pelo
+orjson, com as mesmas conversões para o que não vier destas linhas.
+
+As respostas 200 com mais de COMPRIMIR_MINIMO bytes, e as listagens em
+streaming, são comprimidas com o melhor Accept-Encoding do cliente: br, se o
+pacote Brotli estiver instalado, ou gzip. Uma ETag forte passa a fraca, porque
+o corpo já não é o mesmo byte a byte (como faz o nginx), e o resultado fica em
+cache por ETag e codificação.
+"""
+import gzip
+import os
+import zlib
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+
+import orjson
+from psycopg.postgres import types
+from psycopg.rows import no_result
+
+from cache import CacheTTL
+
+try:
+    import brotli
+except ImportError:  # sem Brotli só há gzip
+    brotli = None
+
+COMPRIMIR_MINIMO = int(os.environ.get("COMPRIMIR_MINIMO", 1024))
+# Nas listas de voos o nível 6 (o do gzip) demora ~1,8x o 4 para ~14% menos bytes (bench/serializacao.py)
+NIVEL_GZIP = int(os.environ.get("NIVEL_GZIP", 4))
+NIVEL_BROTLI = int(os.environ.get("NIVEL_BROTLI", 4))
+
+CODIFICACOES = ("br", "gzip") if brotli else ("gzip",)
+
+DIAS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MESES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+@lru_cache(maxsize=4096)
+def dia_http(dia):
+    """"Sat, 01 Mar 2025 ": a parte da data, que se repete por muitas linhas"""
+
+    return f"{DIAS[dia.weekday()]}, {dia.day:02d} {MESES[dia.month - 1]} {dia.year:04d} "
+
+
+def data_http(valor):
+    """datetime ou date no formato das datas HTTP (o mesmo que werkzeug.http.http_date)"""
+
+    if not isinstance(valor, datetime):
+        return dia_http(valor) + "00:00:00 GMT"
+    if valor.tzinfo is not None:
+        valor = valor.astimezone(timezone.utc)
+    return dia_http(valor.date()) + valor.time().isoformat("seconds") + " GMT"
+
+
+# Conversões por tipo PostgreSQL; as outras colunas passam tal como o psycopg as lê
+CONVERSOES = {
+    types["timestamp"].oid: data_http,
+    types["timestamptz"].oid: data_http,
+    types["date"].oid: data_http,
+    types["numeric"].oid: str,
+}
+
+
+def converter(valor):
+    """default do orjson, para valores que não vêm de linhas_json()"""
+
+    if isinstance(valor, date):
+        return data_http(valor)
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if hasattr(valor, "_asdict"):
+        return valor._asdict()
+    raise TypeError(f"Object of type {type(valor).__name__} is not JSON serializable")
+
+
+def dumps(valor, indentar=False):
+    # As datas vão a converter() (formato HTTP, não ISO); chaves int passam a texto, como no json
+    opcoes = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indentar else 0)
+    return orjson.dumps(valor, default=converter, option=opcoes)
+
+
+class Colunas:
+    """converte os tuplos de uma consulta em dicionários prontos para o orjson"""
+
+    def __init__(self, descricao):
+        self.nomes = [coluna.name for coluna in descricao]
+        self.conversoes = [
+            (i, CONVERSOES[coluna.type_code]) for i, coluna in enumerate(descricao) if coluna.type_code in CONVERSOES
+        ]
+
+    def __call__(self, valores):
+        if self.conversoes:
+            valores = list(valores)
+            for i, conversao in self.conversoes:
+                if valores[i] is not None:
+                    valores[i] = conversao(valores[i])
+        return dict(zip(self.nomes, valores))
+
+
+def linhas_json(cursor):
+    """row factory do psycopg que devolve as linhas de Colunas"""
+
+    if cursor.description is None:
+        return no_result
+    return Colunas(cursor.description)
+
+
+class JSONRapido:
+    """Para juntar ao DefaultJSONProvider do Flask ou do Quart: json pelo orjson.
+
+    As chaves ficam pela ordem das colunas, sem sort_keys.
+    """
+
+    def indentar(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumps(self, obj, **kwargs):
+        # separators e sort_keys (de quem chama o json do Flask) não se aplicam: o orjson é sempre compacto
+        return dumps(obj, "indent" in kwargs).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, self.indentar()) + b"\n", mimetype=self.mimetype)
+
+
+def codificacao(pedido):
+    """a codificação a usar na resposta a `pedido` (Accept-Encoding), ou None"""
+
+    return pedido.accept_encodings.best_match(CODIFICACOES)
+
+
+def comprimir(dados, cod):
+    if cod == "br":
+        return brotli.compress(dados, quality=NIVEL_BROTLI)
+    return gzip.compress(dados, compresslevel=NIVEL_GZIP, mtime=0)
+
+
+def compressor(cod):
+    """(comprimir um bocado, terminar) para corpos em streaming"""
+
+    if cod == "br":
+        c = brotli.Compressor(quality=NIVEL_BROTLI)
+        return (lambda dados: c.process(dados) + c.flush()), c.finish
+    c = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+    return (lambda dados: c.compress(dados) + c.flush(zlib.Z_SYNC_FLUSH)), c.flush
+
+
+def comprimir_partes(partes, cod):
+    """comprime um corpo em streaming; cada parte sai logo, sem esperar pelas seguintes"""
+
+    parte, fim = compressor(cod)
+    try:
+        for dados in partes:
+            yield parte(dados)
+        yield fim()
+    finally:
+        # Se o cliente desligar, o close() tem de chegar ao gerador original
+        if hasattr(partes, "close"):
+            partes.close()
+
+
+async def comprimir_partes_async(partes, cod):
+    """comprimir_partes() para corpos assíncronos (Quart)"""
+
+    parte, fim = compressor(cod)
+    try:
+        async for dados in partes:
+            yield parte(dados)
+        yield fim()
+    finally:
+        if hasattr(partes, "aclose"):
+            await partes.aclose()
+
+
+class Compressao:
+    """Compressão das respostas de uma aplicação, com cache por ETag."""
+
+    def __init__(self, maximo=256, ttl=300.0):
+        self.comprimidas = CacheTTL(maximo=maximo, ttl=ttl)
+
+    def comprimir(self, resposta, dados, cod):
+        """dados comprimidos; os de uma resposta com ETag forte só são comprimidos uma vez"""
+
+        tag, fraca = resposta.get_etag()
+        if not tag or fraca:
+            return comprimir(dados, cod)
+        comprimidos = self.comprimidas.get((tag, cod))
+        if comprimidos is None:
+            comprimidos = comprimir(dados, cod)
+            self.comprimidas.put((tag, cod), comprimidos)
+        return comprimidos
+
+    def aplicavel(self, resposta, streaming):
+        """se a resposta pode ser comprimida (200, ainda sem Content-Encoding, grande ou em streaming)"""
+
+        if resposta.status_code != 200 or "Content-Encoding" in resposta.headers:
+            return False
+        return streaming or (resposta.content_length or 0) >= COMPRIMIR_MINIMO
+
+    def marcar(self, resposta, cod):
+        resposta.headers["Content-Encoding"] = cod
+        tag, fraca = resposta.get_etag()
+        if tag and not fraca:
+            resposta.set_etag(tag, weak=True)
+
+    def __call__(self, resposta, pedido):
+        """hook after_request do Flask"""
+
+        if resposta.direct_passthrough or not self.aplicavel(resposta, resposta.is_streamed):
+            return resposta
+        resposta.vary.add("Accept-Encoding")
+        cod = codificacao(pedido)
+        if cod is None:
+            return resposta
+        if resposta.is_streamed:
+            resposta.response = comprimir_partes(resposta.response, cod)
+        else:
+            resposta.set_data(self.comprimir(resposta, resposta.get_data(), cod))
+        self.marcar(resposta, cod)
+        return resposta
+
+    async def asgi(self, resposta, pedido, streaming):
+        """hook after_request do Quart; `streaming` diz se o corpo é um gerador"""
+
+        if not self.aplicavel(resposta, streaming):
+            return resposta
+        resposta.vary.add("Accept-Encoding")
+        cod = codificacao(pedido)
+        if cod is None:
+            return resposta
+        if streaming:
+            resposta.response = type(resposta.response)(comprimir_partes_async(resposta.response.iter, cod))
+        else:
+            resposta.set_data(self.comprimir(resposta, await resposta.get_data(), cod))
+        self.marcar(resposta, cod)
+        return resposta
@@ -0,0 +1,142 @@
+"""capacidade.sql: os contadores de capacidade_voo batem com a recontagem depois de cada tipo de escrita
+
+Cada teste escreve numa transação desfeita no fim (a fixture conn) e
+verifica capacidade_voo_divergencias antes de a desfazer.
+"""
+import pytest
+from psycopg.errors import RaiseException
+
+import planos
+from conftest import ENTREGA
+
+
+# Os triggers de lugares, que a célula RI-2 do E2-report.ipynb copia de capacidade.sql
+LUGARES = ("-- Assentos acrescentados", "-- Bilhetes: soma")
+
+
+def divergencias(conn):
+    return conn.execute("SELECT * FROM capacidade_voo_divergencias").fetchall()
+
+
+def nova_venda(conn):
+    return conn.execute(
+        "INSERT INTO venda (nif_cliente, hora) VALUES ('999999998', '2025-05-01') RETURNING codigo_reserva"
+    ).fetchone()[0]
+
+
+def voos_com_lugares(conn, n, livres=3, prim_classe=False):
+    voos = [
+        voo for voo, in conn.execute(
+            "SELECT voo_id FROM capacidade_voo WHERE prim_classe = %s AND lugares - vendidos >= %s "
+            "ORDER BY voo_id LIMIT %s",
+            (prim_classe, livres, n),
+        )
+    ]
+    assert len(voos) == n
+    return voos
+
+
+def test_carga_sem_divergencias(conn):
+    assert conn.execute("SELECT count(*) FROM capacidade_voo").fetchone()[0] > 0
+    assert divergencias(conn) == []
+
+
+def test_venda_com_varios_voos(conn):
+    reserva = nova_venda(conn)
+    voos = voos_com_lugares(conn, 3)
+    conn.execute(
+        "INSERT INTO bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe) "
+        "SELECT v, %s, 'Passageiro ' || p, 100, FALSE FROM unnest(%s::integer[]) v, generate_series(1, 3) p",
+        (reserva, voos),
+    )
+    assert divergencias(conn) == []
+
+
+def test_copy(conn):
+    reserva = nova_venda(conn)
+    voos = voos_com_lugares(conn, 2)
+    with conn.cursor().copy(
+        "COPY bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe) FROM STDIN"
+    ) as copy:
+        for voo in voos:
+            for p in range(3):
+                copy.write_row((voo, reserva, f"Passageiro {p}", 100, False))
+    assert divergencias(conn) == []
+
+
+def test_apagar_bilhetes(conn):
+    conn.execute("DELETE FROM bilhete WHERE id IN (SELECT id FROM bilhete ORDER BY id LIMIT 50)")
+    assert divergencias(conn) == []
+
+
+def test_mudar_classe_do_bilhete(conn):
+    (voo,) = voos_com_lugares(conn, 1, livres=1, prim_classe=True)
+    conn.execute(
+        "UPDATE bilhete SET prim_classe = TRUE, lugar = NULL, no_serie = NULL "
+        "WHERE id = (SELECT min(id) FROM bilhete WHERE voo_id = %s AND NOT prim_classe)",
+        (voo,),
+    )
+    assert divergencias(conn) == []
+
+
+def test_apagar_voo(conn):
+    voo = conn.execute("SELECT min(voo_id) FROM capacidade_voo").fetchone()[0]
+    conn.execute("DELETE FROM bilhete WHERE voo_id = %s", (voo,))
+    conn.execute("DELETE FROM voo WHERE id = %s", (voo,))
+    assert divergencias(conn) == []
+    assert conn.execute("SELECT count(*) FROM capacidade_voo WHERE voo_id = %s", (voo,)).fetchone()[0] == 0
+
+
+def test_acrescentar_e_retirar_assentos(conn):
+    aviao = conn.execute("SELECT min(no_serie) FROM aviao").fetchone()[0]
+    conn.execute("INSERT INTO assento (lugar, no_serie) VALUES ('99A', %s), ('99B', %s)", (aviao, aviao))
+    assert divergencias(conn) == []
+    conn.execute("DELETE FROM assento WHERE no_serie = %s AND lugar = '99A'", (aviao,))
+    assert divergencias(conn) == []
+
+
+def test_mudar_classe_do_assento(conn):
+    aviao = conn.execute("SELECT min(no_serie) FROM aviao").fetchone()[0]
+    conn.execute(
+        "UPDATE assento SET prim_classe = NOT prim_classe "
+        "WHERE no_serie = %s AND lugar IN (SELECT lugar FROM assento WHERE no_serie = %s ORDER BY lugar LIMIT 4)",
+        (aviao, aviao),
+    )
+    assert divergencias(conn) == []
+
+
+def test_mudar_aviao_do_voo(conn):
+    voo, aviao = conn.execute("SELECT id, no_serie FROM voo ORDER BY id LIMIT 1").fetchone()
+    conn.execute("INSERT INTO aviao (no_serie, modelo) VALUES ('TESTE-1', 'Teste')")
+    # O avião novo tem mais um lugar em primeira classe e menos um em segunda
+    conn.execute(
+        "INSERT INTO assento (lugar, no_serie, prim_classe) "
+        "SELECT lugar, 'TESTE-1', prim_classe OR lugar = min(lugar) OVER () FROM assento WHERE no_serie = %s",
+        (aviao,),
+    )
+    conn.execute("UPDATE voo SET no_serie = 'TESTE-1' WHERE id = %s", (voo,))
+    assert divergencias(conn) == []
+
+
+def test_classe_esgotada(conn):
+    reserva = nova_venda(conn)
+    (voo,) = voos_com_lugares(conn, 1, livres=1, prim_classe=True)
+    livres = conn.execute(
+        "SELECT lugares - vendidos FROM capacidade_voo WHERE voo_id = %s AND prim_classe", (voo,)
+    ).fetchone()[0]
+    with pytest.raises(RaiseException, match="primeira classe esgotados"), conn.transaction():
+        conn.execute(
+            "INSERT INTO bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe) "
+            "SELECT %s, %s, 'Passageiro ' || p, 100, TRUE FROM generate_series(1, %s) p",
+            (voo, reserva, livres + 1),
+        )
+    assert divergencias(conn) == []
+
+
+def test_relatorio_com_os_triggers_de_lugares():
+    def lugares(sql):
+        inicio, fim = LUGARES
+        return sql[sql.index(inicio):sql.index(fim)]
+
+    (celula,) = planos.ler_notebook("-- (RI-2) com contadores")
+    assert lugares(celula) == lugares((ENTREGA / "capacidade.sql").read_text())
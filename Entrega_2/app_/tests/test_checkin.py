@@ -0,0 +1,137 @@
+"""Check-in individual e em lote (consultas.py): os lugares livres são os de cada voo, com o avião partilhado
+
+Os check-ins correm como nos handlers de app.py, pelo registo e com os
+inteiros como int8, em ligações próprias: uma fica com a transação aberta
+enquanto outra faz o check-in noutro voo do mesmo avião. Cada teste tem um
+avião novo com dois lugares de segunda classe (1A e 1B) e dois voos, cada um
+com dois bilhetes sem lugar.
+"""
+import itertools
+from collections import namedtuple
+from contextlib import contextmanager
+
+import psycopg
+import pytest
+from psycopg.errors import LockNotAvailable
+from psycopg.rows import namedtuple_row
+
+import registo
+
+Voos = namedtuple("Voos", "voos bilhetes")
+
+avioes = itertools.count()
+
+
+@contextmanager
+def ligar(url):
+    """ligação como as do pool de app.py, que desiste ao fim de 2 s à espera de um bloqueio"""
+
+    with psycopg.connect(url, autocommit=True, row_factory=namedtuple_row) as conn:
+        registo.usar_int8(conn)
+        conn.execute("SET lock_timeout = '2s'")
+        yield conn
+
+
+@pytest.fixture
+def voos(aviacao):
+    """dois voos do mesmo avião (1A e 1B em segunda classe), cada um com dois bilhetes sem lugar"""
+
+    n = next(avioes)
+    aviao = f"TESTE-CHECKIN-{n}"
+    with ligar(aviacao) as conn, conn.transaction():
+        conn.execute("INSERT INTO aviao (no_serie, modelo) VALUES (%s, 'Teste')", (aviao,))
+        conn.execute("INSERT INTO assento (lugar, no_serie) VALUES ('1A', %s), ('1B', %s)", (aviao, aviao))
+        partida, chegada = conn.execute("SELECT codigo FROM aeroporto ORDER BY codigo LIMIT 2").fetchall()
+        voos = [
+            conn.execute(
+                "INSERT INTO voo (no_serie, hora_partida, hora_chegada, partida, chegada) "
+                "VALUES (%s, TIMESTAMP '2030-01-01' + %s * INTERVAL '1 day', "
+                "TIMESTAMP '2030-01-01 02:00' + %s * INTERVAL '1 day', %s, %s) RETURNING id",
+                (aviao, 2 * n + i, 2 * n + i, partida.codigo, chegada.codigo),
+            ).fetchone().id
+            for i in range(2)
+        ]
+        (reserva,) = conn.execute(
+            "INSERT INTO venda (nif_cliente, hora) VALUES ('999999998', '2025-05-01') RETURNING codigo_reserva"
+        ).fetchone()
+        bilhetes = {
+            voo: [
+                linha.id for linha in conn.execute(
+                    "INSERT INTO bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, no_serie) "
+                    "SELECT %s, %s, 'Passageiro ' || p, 100, %s FROM generate_series(1, 2) p RETURNING id",
+                    (voo, reserva, aviao),
+                )
+            ]
+            for voo in voos
+        }
+    return Voos(voos, bilhetes)
+
+
+def checkin(conn, bilhete):
+    """os passos de checkin() em app.py, na transação aberta em conn; o lugar atribuído ou None"""
+
+    linha = registo.executar(conn, "checkin:bilhete", {"bilhete": bilhete}).fetchone()
+    registo.executar(conn, "checkin:bloqueio", {"voo_id": linha.voo_id, "prim_classe": linha.prim_classe})
+    assento = registo.executar(
+        conn,
+        "checkin:lugar",
+        {"no_serie": linha.no_serie, "prim_classe": linha.prim_classe, "voo_id": linha.voo_id, "bilhete": bilhete},
+    ).fetchone()
+    return assento.lugar if assento else None
+
+
+def lote(conn, voo):
+    """os passos de checkin_lote() em app.py para um voo, na transação aberta em conn; {bilhete: lugar}"""
+
+    registo.executar(conn, "checkin:voo_bloqueio", {"voo": voo})
+    return {linha.id: linha.lugar for linha in registo.executar(conn, "checkin:voo", {"voo": voo})}
+
+
+def test_lugar_livre_noutro_voo_do_aviao(aviacao, voos):
+    voo1, voo2 = voos.voos
+    with ligar(aviacao) as a, ligar(aviacao) as b:
+        with a.transaction():
+            assert checkin(a, voos.bilhetes[voo1][0]) == "1A"
+        with b.transaction():
+            assert checkin(b, voos.bilhetes[voo2][0]) == "1A"
+
+        # O 1B fica atribuído no voo 1, numa transação ainda aberta; no voo 2 está livre
+        with a.transaction():
+            assert checkin(a, voos.bilhetes[voo1][1]) == "1B"
+            with b.transaction():
+                assert checkin(b, voos.bilhetes[voo2][1]) == "1B"
+
+
+def test_mesmo_voo_um_de_cada_vez(aviacao, voos):
+    voo1, _ = voos.voos
+    with ligar(aviacao) as a, ligar(aviacao) as b:
+        with a.transaction():
+            assert checkin(a, voos.bilhetes[voo1][0]) == "1A"
+            # Outro check-in na mesma classe do mesmo voo espera pelo primeiro
+            with pytest.raises(LockNotAvailable), b.transaction():
+                checkin(b, voos.bilhetes[voo1][1])
+        with b.transaction():
+            assert checkin(b, voos.bilhetes[voo1][1]) == "1B"
+
+
+def test_lote_noutro_voo_do_aviao(aviacao, voos):
+    voo1, voo2 = voos.voos
+    with ligar(aviacao) as a, ligar(aviacao) as b:
+        with a.transaction():
+            # O lote do voo 1 fica com os dois lugares numa transação ainda aberta
+            assert sorted(lote(a, voo1).values()) == ["1A", "1B"]
+            with b.transaction():
+                assert checkin(b, voos.bilhetes[voo2][0]) == "1A"
+            with b.transaction():
+                assert lote(b, voo2) == {voos.bilhetes[voo2][1]: "1B"}
+
+
+def test_lote_e_checkin_no_mesmo_voo(aviacao, voos):
+    voo1, _ = voos.voos
+    with ligar(aviacao) as a, ligar(aviacao) as b:
+        with a.transaction():
+            assert checkin(a, voos.bilhetes[voo1][0]) == "1A"
+            with pytest.raises(LockNotAvailable), b.transaction():
+                lote(b, voo1)
+        with b.transaction():
+            assert lote(b, voo1) == {voos.bilhetes[voo1][1]: "1B"}
@@ -0,0 +1,132 @@
+"""estatisticas.sql e agregados.sql: estatisticas_voos bate com o cálculo de raiz depois de cada tipo de escrita
+
+Cada teste escreve numa transação desfeita no fim (a fixture conn) e
+verifica estatisticas_voos_divergencias antes de a desfazer.
+"""
+from decimal import Decimal
+
+from conftest import ENTREGA
+
+
+def divergencias(conn):
+    return conn.execute("SELECT * FROM estatisticas_voos_divergencias").fetchall()
+
+
+def vender(conn, voos, prim_classe=False):
+    """uma venda com três bilhetes em cada voo"""
+
+    (reserva,) = conn.execute(
+        "INSERT INTO venda (nif_cliente, hora) VALUES ('999999998', '2025-05-01') RETURNING codigo_reserva"
+    ).fetchone()
+    conn.execute(
+        "INSERT INTO bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe) "
+        "SELECT v, %s, 'Passageiro ' || p, 100 + p, %s FROM unnest(%s::integer[]) v, generate_series(1, 3) p",
+        (reserva, prim_classe, voos),
+    )
+    return reserva
+
+
+def voos_com_lugares(conn, n, prim_classe=False):
+    return [
+        voo for voo, in conn.execute(
+            "SELECT voo_id FROM capacidade_voo WHERE prim_classe = %s AND lugares - vendidos >= 3 "
+            "ORDER BY voo_id LIMIT %s",
+            (prim_classe, n),
+        )
+    ]
+
+
+def test_carga_sem_divergencias(conn):
+    assert conn.execute("SELECT count(*) FROM estatisticas_voos").fetchone()[0] > 0
+    assert divergencias(conn) == []
+
+
+def test_venda_com_varios_voos(conn):
+    vender(conn, voos_com_lugares(conn, 3))
+    vender(conn, voos_com_lugares(conn, 2, prim_classe=True), prim_classe=True)
+    assert divergencias(conn) == []
+
+
+def test_copy(conn):
+    voos = voos_com_lugares(conn, 2)
+    reserva = vender(conn, voos[:1])
+    with conn.cursor().copy(
+        "COPY bilhete (voo_id, codigo_reserva, nome_passegeiro, preco, prim_classe) FROM STDIN"
+    ) as copy:
+        for p in range(3):
+            copy.write_row((voos[1], reserva, f"Passageiro {p}", Decimal("99.90"), False))
+    assert divergencias(conn) == []
+
+
+def test_apagar_bilhetes(conn):
+    conn.execute("DELETE FROM bilhete WHERE id IN (SELECT id FROM bilhete ORDER BY id LIMIT 50)")
+    assert divergencias(conn) == []
+
+
+def test_apagar_todos_os_bilhetes_do_voo(conn):
+    # Sem bilhetes as vendas voltam a NULL, como no cálculo de raiz
+    conn.execute("DELETE FROM bilhete WHERE voo_id = (SELECT min(voo_id) FROM bilhete)")
+    assert divergencias(conn) == []
+
+
+def test_mudar_classe_e_preco_do_bilhete(conn):
+    (voo,) = voos_com_lugares(conn, 1, prim_classe=True)
+    conn.execute(
+        "UPDATE bilhete SET prim_classe = TRUE, preco = preco + 10, lugar = NULL, no_serie = NULL "
+        "WHERE id = (SELECT min(id) FROM bilhete WHERE voo_id = %s AND NOT prim_classe)",
+        (voo,),
+    )
+    assert divergencias(conn) == []
+
+
+def test_checkin(conn):
+    conn.execute(
+        "UPDATE bilhete SET lugar = NULL, no_serie = NULL WHERE id IN (SELECT id FROM bilhete ORDER BY id LIMIT 10)"
+    )
+    assert divergencias(conn) == []
+
+
+def test_mudar_hora_do_voo(conn):
+    conn.execute(
+        "UPDATE voo SET hora_partida = hora_partida + INTERVAL '1 day', hora_chegada = hora_chegada + INTERVAL '1 day' "
+        "WHERE id = (SELECT max(id) FROM voo)"
+    )
+    assert divergencias(conn) == []
+
+
+def test_apagar_voo(conn):
+    voo = conn.execute("SELECT min(id) FROM voo").fetchone()[0]
+    conn.execute("DELETE FROM bilhete WHERE voo_id = %s", (voo,))
+    conn.execute("DELETE FROM voo WHERE id = %s", (voo,))
+    assert divergencias(conn) == []
+
+
+def test_mudar_cidade_do_aeroporto(conn):
+    conn.execute("UPDATE aeroporto SET cidade = cidade || ' (teste)' WHERE codigo = (SELECT min(partida) FROM voo)")
+    assert divergencias(conn) == []
+
+
+def test_assentos(conn):
+    aviao = conn.execute("SELECT min(no_serie) FROM aviao").fetchone()[0]
+    conn.execute("INSERT INTO assento (lugar, no_serie) VALUES ('99A', %s), ('99B', %s)", (aviao, aviao))
+    assert divergencias(conn) == []
+    conn.execute("DELETE FROM assento WHERE no_serie = %s AND lugar = '99A'", (aviao,))
+    assert divergencias(conn) == []
+    conn.execute(
+        "UPDATE assento SET prim_classe = NOT prim_classe "
+        "WHERE no_serie = %s AND lugar IN (SELECT lugar FROM assento WHERE no_serie = %s ORDER BY lugar LIMIT 4)",
+        (aviao, aviao),
+    )
+    assert divergencias(conn) == []
+
+
+def test_agregados_depois_das_escritas(conn):
+    vender(conn, voos_com_lugares(conn, 3))
+    conn.execute("DELETE FROM bilhete WHERE id IN (SELECT id FROM bilhete ORDER BY id LIMIT 50)")
+    conn.execute((ENTREGA / "agregados.sql").read_text())
+
+    passageiros, vendas = conn.execute("SELECT count(*), sum(preco) FROM bilhete WHERE voo_id IS NOT NULL").fetchone()
+    assert conn.execute("SELECT sum(passageiros) FROM agregado_rotas").fetchone()[0] == passageiros
+    assert conn.execute(
+        "SELECT voos, vendas_1c + vendas_2c FROM agregado_vendas WHERE nivel_espaco = 0 AND nivel_tempo = 0"
+    ).fetchone() == (conn.execute("SELECT count(*) FROM voo").fetchone()[0], vendas)
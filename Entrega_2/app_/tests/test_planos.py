@@ -0,0 +1,70 @@
+"""bench/planos.py como verificação: os planos das consultas não regridem
+
+Prepara uma base de dados descartável com `planos.py preparar --scale 1`,
+mede as consultas com `planos.py capturar` (que termina com código 1 se algum
+caminho quente tiver seq scans grandes) e compara os blocos lidos por cada
+consulta com planos_base.json, com os limiares de `planos.py comparar`. O
+tempo não é comparado: depende da máquina.
+
+Depois de uma alteração que muda os planos de propósito (um índice novo, mais
+dados no gerador.py), a base reescreve-se com
+
+    PLANOS_ATUALIZAR=1 python -m pytest tests/test_planos.py
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import planos
+
+BASE = Path(__file__).with_name("planos_base.json")
+
+# Os limiares por defeito de planos.py comparar, sem o tempo
+LIMIARES = planos.Limiares(tempo=None, folga_ms=0, blocos=20, folga_blocos=8)
+
+
+def correr_planos(database_url, *args):
+    return subprocess.run(
+        [sys.executable, planos.__file__, "--database-url", database_url, *args],
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.fixture(scope="module")
+def captura(base_dados, tmp_path_factory):
+    """(processo do capturar, JSON da captura)"""
+
+    preparar = correr_planos(base_dados, "preparar", "--scale", "1")
+    assert preparar.returncode == 0, preparar.stderr
+    saida = tmp_path_factory.mktemp("planos") / "novo.json"
+    capturar = correr_planos(base_dados, "capturar", "-n", "3", "-o", str(saida))
+    assert saida.exists(), capturar.stderr
+    return capturar, json.loads(saida.read_text())
+
+
+def test_sem_seq_scans_em_caminhos_quentes(captura):
+    capturar, _ = captura
+    assert capturar.returncode == 0, capturar.stdout
+
+
+def test_blocos_como_na_base(captura):
+    _, novo = captura
+    if os.environ.get("PLANOS_ATUALIZAR"):
+        blocos = {nome: {"blocos": resultado["blocos"]} for nome, resultado in novo["consultas"].items()}
+        BASE.write_text(json.dumps(blocos, indent=2) + "\n")
+
+    base = json.loads(BASE.read_text())
+    limite = novo["configuracao"]["limite"]
+    regressoes = {}
+    for nome, resultado in novo["consultas"].items():
+        motivos = planos.motivos_regressao(base.get(nome), resultado, limite, LIMIARES)
+        if motivos:
+            regressoes[nome] = motivos
+    assert regressoes == {}
+    # Uma consulta que deixou de ser medida também tem de ser tirada da base
+    assert sorted(set(base) - set(novo["consultas"])) == []
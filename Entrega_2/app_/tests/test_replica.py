@@ -0,0 +1,209 @@
+"""replica.PoolLeitura e PoolLeituraAsync: quando é que uma leitura volta ao primário
+
+Os pools são falsos: o da réplica responde à consulta ESTADO com o atraso e o
+LSN que o teste escolher, ou falha como uma réplica em baixo ou sem ligações
+livres. Não precisa do PostgreSQL.
+"""
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg
+import pytest
+from prometheus_client import REGISTRY
+from psycopg_pool import PoolTimeout
+
+import replica
+
+
+class Cursor:
+    def __init__(self, linha):
+        self.linha = linha
+
+    def fetchone(self):
+        return self.linha
+
+
+class Ligacao:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def execute(self, sql):
+        assert sql == replica.ESTADO
+        self.pool.consultas += 1
+        return Cursor(self.pool.estado)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Pool:
+    """pool falso; estado é a linha (atraso, lsn) de ESTADO, falha a exceção de connection() e getconn()"""
+
+    def __init__(self, estado=(0.0, "0/100"), falha=None, falha_getconn=None):
+        self.estado = estado
+        self.falha = falha
+        self.falha_getconn = falha_getconn
+        self.consultas = 0
+        self.emprestadas = 0
+        self.verificado = False
+
+    @contextmanager
+    def connection(self, timeout=None):
+        if self.falha:
+            raise self.falha
+        yield Ligacao(self)
+
+    def getconn(self, timeout=None):
+        if self.falha_getconn:
+            raise self.falha_getconn
+        self.emprestadas += 1
+        return Ligacao(self)
+
+    def putconn(self, conn):
+        self.emprestadas -= 1
+
+    def check(self):
+        self.verificado = True
+
+
+class PoolAsync(Pool):
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        with Pool.connection(self, timeout) as conn:
+            yield LigacaoAsync(conn)
+
+    async def getconn(self, timeout=None):
+        return LigacaoAsync(Pool.getconn(self, timeout))
+
+    async def putconn(self, conn):
+        Pool.putconn(self, conn)
+
+    async def check(self):
+        Pool.check(self)
+
+
+class LigacaoAsync:
+    def __init__(self, conn):
+        self.conn = conn
+        self.pool = conn.pool
+
+    async def execute(self, sql):
+        cursor = self.conn.execute(sql)
+
+        class CursorAsync:
+            async def fetchone(self):
+                return cursor.fetchone()
+
+        return CursorAsync()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+def leituras(motivo):
+    destino = "replica" if motivo is None else "primario"
+    return REGISTRY.get_sample_value("aviacao_leituras_total", {"destino": destino, "motivo": motivo or ""}) or 0
+
+
+def ler(leitura, lsn=None):
+    """(pool que deu a ligação, motivo contado) de uma leitura"""
+
+    antes = {motivo: leituras(motivo) for motivo in replica.SERIES}
+    if isinstance(leitura, replica.PoolLeituraAsync):
+        async def pedir():
+            async with leitura.connection(lsn) as conn:
+                return conn.pool
+
+        pool = asyncio.run(pedir())
+    else:
+        with leitura.connection(lsn) as conn:
+            pool = conn.pool
+    if leitura.replica is None:
+        return pool, "sem réplica"
+    (motivo,) = [motivo for motivo in replica.SERIES if leituras(motivo) > antes[motivo]]
+    return pool, motivo
+
+
+@pytest.fixture(params=["sync", "async"])
+def criar(request):
+    """cria um PoolLeitura (ou PoolLeituraAsync) com pools falsos: criar(estado=..., falha=..., **kwargs)"""
+
+    pool = Pool if request.param == "sync" else PoolAsync
+    classe = replica.PoolLeitura if request.param == "sync" else replica.PoolLeituraAsync
+
+    def criar(sem_replica=False, **kwargs):
+        estado = {chave: kwargs.pop(chave) for chave in ("estado", "falha", "falha_getconn") if chave in kwargs}
+        return classe(pool(), None if sem_replica else pool(**estado), **kwargs)
+
+    return criar
+
+
+def test_replica_em_dia(criar):
+    leitura = criar()
+    assert ler(leitura) == (leitura.replica, None)
+    assert leitura.replica.emprestadas == 0
+
+
+def test_sem_replica(criar):
+    leitura = criar(sem_replica=True)
+    assert ler(leitura) == (leitura.primario, "sem réplica")
+
+
+def test_replica_atrasada(criar):
+    leitura = criar(estado=(10.0, "0/100"), atraso_maximo=5.0)
+    assert ler(leitura) == (leitura.primario, "atraso")
+
+
+def test_replica_em_baixo(criar):
+    leitura = criar(falha=psycopg.OperationalError("a réplica foi reiniciada"))
+    assert ler(leitura) == (leitura.primario, "atraso")
+    # As ligações partidas são trocadas logo
+    assert leitura.replica.verificado
+
+
+def test_replica_sem_ligacoes_para_o_estado(criar):
+    leitura = criar(falha=PoolTimeout())
+    assert ler(leitura) == (leitura.primario, "atraso")
+
+
+def test_pool_da_replica_esgotado(criar):
+    leitura = criar(falha_getconn=PoolTimeout())
+    assert ler(leitura) == (leitura.primario, "pool")
+
+
+def test_escrita_ainda_nao_reproduzida(criar):
+    leitura = criar(estado=(0.0, "0/100"))
+    assert ler(leitura, "0/200") == (leitura.primario, "escrita")
+    assert ler(leitura, "0/100") == (leitura.replica, None)
+    assert ler(leitura, "0/50") == (leitura.replica, None)
+
+
+def test_cookie_invalido(criar):
+    leitura = criar()
+    assert ler(leitura, "não é um LSN") == (leitura.replica, None)
+
+
+def test_sem_leitura_apos_escrita(criar):
+    leitura = criar(estado=(0.0, "0/100"), apos_escrita=False)
+    assert ler(leitura, "0/200") == (leitura.replica, None)
+
+
+def test_estado_relido_so_depois_do_ttl(criar):
+    leitura = criar(ttl=60)
+    ler(leitura)
+    ler(leitura)
+    assert leitura.replica.consultas == 1
+    leitura.expira = 0
+    ler(leitura)
+    assert leitura.replica.consultas == 2
+
+
+def test_ler_lsn():
+    assert replica.ler_lsn("16/B374D848") == (0x16 << 32) + 0xB374D848
+    assert replica.ler_lsn("0/200") > replica.ler_lsn("0/100")
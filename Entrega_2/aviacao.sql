@@ -6,7 +6,7 @@ DROP TABLE IF EXISTS venda CASCADE;
 DROP TABLE IF EXISTS bilhete CASCADE;
 
 CREATE TABLE aeroporto(
-	codigo CHAR(3) PRIMARY KEY CHECK (codigo ~ '^[A-Z]$'),
+	codigo CHAR(3) PRIMARY KEY CHECK (codigo ~ '^[A-Z]{3}$'),
 	nome VARCHAR(80) NOT NULL,
 	cidade VARCHAR(255) NOT NULL,
 	pais VARCHAR(255) NOT NULL,
@@ -25,6 +25,10 @@ CREATE TABLE assento (
 	PRIMARY KEY (lugar, no_serie)
 );
 
+-- Lugares de um avião, por classe (mapa de /voos/<id>/assentos, escolha de lugar no check-in e o
+-- trigger verificar_checkin_bilhete); a chave primária começa pelo lugar e não serve
+CREATE INDEX idx_assento_aviao ON assento (no_serie, prim_classe, lugar);
+
 CREATE TABLE voo (
 	id SERIAL PRIMARY KEY,
 	no_serie VARCHAR(80) REFERENCES aviao,
@@ -40,6 +44,12 @@ CREATE TABLE voo (
 	CHECK (hora_partida<=hora_chegada)
 );
 
+-- Pesquisa de voos por rota, por ordem de partida (/voos/<partida>/<chegada>)
+CREATE INDEX idx_voo_rota ON voo (partida, chegada, hora_partida);
+
+-- Partidas de um aeroporto por ordem de hora, paginadas por (hora_partida, id) (/partidas/<partida>)
+CREATE INDEX idx_voo_partida ON voo (partida, hora_partida, id);
+
 CREATE TABLE venda (
 	codigo_reserva SERIAL PRIMARY KEY,
 	nif_cliente CHAR(9) NOT NULL,
@@ -57,5 +67,10 @@ CREATE TABLE bilhete (
 	lugar VARCHAR(3),
 	no_serie VARCHAR(80),
 	UNIQUE (voo_id, codigo_reserva, nome_passegeiro),
+	-- Um lugar só pode ser atribuído a um bilhete por voo (os NULL não colidem)
+	UNIQUE (voo_id, lugar),
 	FOREIGN KEY (lugar, no_serie) REFERENCES assento
 );
+
+-- Bilhetes de uma venda (/reservas/<reserva>/bilhetes); a chave estrangeira não tem índice
+CREATE INDEX idx_bilhete_reserva ON bilhete (codigo_reserva, id);
@@ -0,0 +1,257 @@
+-- (RI-2) com contadores de capacidade por voo e classe
+--
+-- capacidade_voo guarda, para cada voo e classe, o número de assentos do avião
+-- (lugares) e o número de bilhetes vendidos (vendidos). As linhas são criadas
+-- quando o voo é inserido e atualizadas na mesma transação que altera bilhete,
+-- pelo que a verificação da RI-2 passa a ser a atualização de uma linha em vez
+-- de quatro COUNT(*) sobre assento e bilhete.
+--
+-- Os triggers são por instrução (FOR EACH STATEMENT) e usam as tabelas de
+-- transição: um INSERT de N bilhetes, ou um COPY, atualiza cada contador uma
+-- única vez.
+--
+-- Pode ser executado sobre uma base de dados já carregada: os contadores são
+-- recalculados a partir de voo, assento e bilhete no fim do ficheiro.
+
+DROP TRIGGER IF EXISTS trigger_verificar_capacidade_bilhete ON bilhete;
+
+CREATE TABLE IF NOT EXISTS capacidade_voo (
+    voo_id INTEGER,
+    prim_classe BOOLEAN,
+    lugares INTEGER NOT NULL,
+    vendidos INTEGER NOT NULL DEFAULT 0 CHECK (vendidos >= 0),
+    PRIMARY KEY (voo_id, prim_classe)
+);
+
+
+-- Os contadores de um voo apagado saem com ele. Com voo particionado
+-- (particoes.sql) voo.id deixa de ser único por si e não pode ser referenciado:
+-- a chave estrangeira dá lugar a um trigger.
+CREATE OR REPLACE FUNCTION apagar_capacidade_voo() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM capacidade_voo WHERE voo_id IN (SELECT id FROM antigos);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'voo'::regclass) THEN
+        ALTER TABLE capacidade_voo DROP CONSTRAINT IF EXISTS capacidade_voo_voo_id_fkey;
+
+        CREATE OR REPLACE TRIGGER trigger_apagar_capacidade_voo AFTER DELETE ON voo
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION apagar_capacidade_voo();
+    ELSIF NOT EXISTS (SELECT 1 FROM pg_constraint
+                      WHERE conrelid = 'capacidade_voo'::regclass AND conname = 'capacidade_voo_voo_id_fkey') THEN
+        ALTER TABLE capacidade_voo ADD FOREIGN KEY (voo_id) REFERENCES voo ON DELETE CASCADE;
+    END IF;
+END;
+$$;
+
+
+-- Contadores calculados de raiz a partir de voo, assento e bilhete
+CREATE OR REPLACE VIEW capacidade_voo_recontagem AS
+SELECT v.id AS voo_id, c.prim_classe,
+       COALESCE(l.n, 0)::INTEGER AS lugares,
+       COALESCE(b.n, 0)::INTEGER AS vendidos
+FROM voo v
+CROSS JOIN (VALUES (TRUE), (FALSE)) AS c(prim_classe)
+LEFT JOIN (SELECT no_serie, prim_classe, COUNT(*) AS n
+           FROM assento GROUP BY no_serie, prim_classe) l
+       ON l.no_serie = v.no_serie AND l.prim_classe = c.prim_classe
+LEFT JOIN (SELECT voo_id, prim_classe, COUNT(*) AS n
+           FROM bilhete GROUP BY voo_id, prim_classe) b
+       ON b.voo_id = v.id AND b.prim_classe = c.prim_classe;
+
+
+-- Contadores que não batem certo com a recontagem (deve estar sempre vazia;
+-- app_/tests/test_capacidade.py verifica-a depois de cada tipo de escrita)
+CREATE OR REPLACE VIEW capacidade_voo_divergencias AS
+SELECT r.voo_id, r.prim_classe,
+       cv.lugares, cv.vendidos,
+       r.lugares AS lugares_reais, r.vendidos AS vendidos_reais
+FROM capacidade_voo_recontagem r
+LEFT JOIN capacidade_voo cv ON cv.voo_id = r.voo_id AND cv.prim_classe = r.prim_classe
+WHERE cv.lugares IS DISTINCT FROM r.lugares
+   OR cv.vendidos IS DISTINCT FROM r.vendidos;
+
+
+-- Recalcula todos os contadores (migração, ou depois de uma carga com os
+-- triggers de bilhete desligados)
+CREATE OR REPLACE FUNCTION recalcular_capacidade_voo() RETURNS VOID AS $$
+BEGIN
+    DELETE FROM capacidade_voo;
+
+    INSERT INTO capacidade_voo (voo_id, prim_classe, lugares, vendidos)
+    SELECT voo_id, prim_classe, lugares, vendidos
+    FROM capacidade_voo_recontagem;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Novos voos: uma linha por classe com o número de assentos do avião
+CREATE OR REPLACE FUNCTION criar_capacidade_voo() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO capacidade_voo (voo_id, prim_classe, lugares)
+    SELECT n.id, c.prim_classe, COUNT(a.lugar)
+    FROM novos n
+    CROSS JOIN (VALUES (TRUE), (FALSE)) AS c(prim_classe)
+    LEFT JOIN assento a ON a.no_serie = n.no_serie AND a.prim_classe = c.prim_classe
+    GROUP BY n.id, c.prim_classe;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_criar_capacidade_voo AFTER INSERT ON voo
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION criar_capacidade_voo();
+
+
+-- Assentos acrescentados, retirados ou alterados (p.ex. a classe) mudam a
+-- capacidade dos voos do avião; um UPDATE conta como retirar as linhas antigas
+-- e acrescentar as novas
+CREATE OR REPLACE FUNCTION atualizar_lugares_voo() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE capacidade_voo cv
+        SET lugares = cv.lugares + d.n
+        FROM (SELECT no_serie, prim_classe, COUNT(*) AS n FROM novos GROUP BY no_serie, prim_classe) d
+        JOIN voo v ON v.no_serie = d.no_serie
+        WHERE cv.voo_id = v.id AND cv.prim_classe = d.prim_classe;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE capacidade_voo cv
+        SET lugares = cv.lugares - d.n
+        FROM (SELECT no_serie, prim_classe, COUNT(*) AS n FROM antigos GROUP BY no_serie, prim_classe) d
+        JOIN voo v ON v.no_serie = d.no_serie
+        WHERE cv.voo_id = v.id AND cv.prim_classe = d.prim_classe;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_lugares_assento_insert AFTER INSERT ON assento
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_lugares_voo();
+
+CREATE OR REPLACE TRIGGER trigger_lugares_assento_update AFTER UPDATE ON assento
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_lugares_voo();
+
+CREATE OR REPLACE TRIGGER trigger_lugares_assento_delete AFTER DELETE ON assento
+    REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_lugares_voo();
+
+
+-- Voos que mudam de avião passam a ter os lugares do avião novo
+CREATE OR REPLACE FUNCTION atualizar_lugares_aviao_voo() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE capacidade_voo cv
+    SET lugares = (SELECT COUNT(*) FROM assento a
+                   WHERE a.no_serie = n.no_serie AND a.prim_classe = cv.prim_classe)
+    FROM novos n
+    JOIN antigos o ON o.id = n.id
+    WHERE cv.voo_id = n.id AND n.no_serie IS DISTINCT FROM o.no_serie;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_lugares_voo_update AFTER UPDATE ON voo
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_lugares_aviao_voo();
+
+
+-- Bilhetes: soma a variação de vendidos por (voo, classe) e recusa a instrução
+-- se algum contador ultrapassar a capacidade
+CREATE OR REPLACE FUNCTION verificar_capacidade_bilhete() RETURNS TRIGGER AS $$
+DECLARE
+    voos INTEGER[];
+    classes BOOLEAN[];
+    deltas INTEGER[];
+    atualizados INTEGER;
+    esgotada BOOLEAN;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(voo_id), array_agg(prim_classe), array_agg(n)
+        INTO voos, classes, deltas
+        FROM (SELECT voo_id, prim_classe, COUNT(*) AS n
+              FROM novos WHERE voo_id IS NOT NULL
+              GROUP BY voo_id, prim_classe) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(voo_id), array_agg(prim_classe), array_agg(n)
+        INTO voos, classes, deltas
+        FROM (SELECT voo_id, prim_classe, -COUNT(*) AS n
+              FROM antigos WHERE voo_id IS NOT NULL
+              GROUP BY voo_id, prim_classe) d;
+    ELSE
+        -- Um check-in não muda voo_id nem prim_classe e não toca nos contadores
+        SELECT array_agg(voo_id), array_agg(prim_classe), array_agg(n)
+        INTO voos, classes, deltas
+        FROM (SELECT voo_id, prim_classe, SUM(n) AS n
+              FROM (SELECT voo_id, prim_classe, 1 AS n FROM novos
+                    UNION ALL
+                    SELECT voo_id, prim_classe, -1 FROM antigos) m
+              WHERE voo_id IS NOT NULL
+              GROUP BY voo_id, prim_classe
+              HAVING SUM(n) <> 0) d;
+    END IF;
+
+    IF voos IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- Bloqueia os contadores sempre pela mesma ordem, para que duas vendas
+    -- com vários voos não fiquem em deadlock
+    PERFORM 1
+    FROM capacidade_voo cv
+    JOIN unnest(voos, classes) AS d(voo_id, prim_classe)
+      ON cv.voo_id = d.voo_id AND cv.prim_classe = d.prim_classe
+    ORDER BY cv.voo_id, cv.prim_classe
+    FOR UPDATE OF cv;
+
+    UPDATE capacidade_voo cv
+    SET vendidos = cv.vendidos + d.n
+    FROM unnest(voos, classes, deltas) AS d(voo_id, prim_classe, n)
+    WHERE cv.voo_id = d.voo_id AND cv.prim_classe = d.prim_classe;
+
+    GET DIAGNOSTICS atualizados = ROW_COUNT;
+    IF atualizados < cardinality(voos) THEN
+        RAISE EXCEPTION 'Voo sem contador de capacidade (execute SELECT recalcular_capacidade_voo()).';
+    END IF;
+
+    SELECT cv.prim_classe INTO esgotada
+    FROM capacidade_voo cv
+    JOIN unnest(voos, classes, deltas) AS d(voo_id, prim_classe, n)
+      ON cv.voo_id = d.voo_id AND cv.prim_classe = d.prim_classe
+    WHERE d.n > 0 AND cv.vendidos > cv.lugares
+    LIMIT 1;
+
+    IF esgotada THEN
+        RAISE EXCEPTION 'Bilhetes de primeira classe esgotados para este voo.';
+    ELSIF NOT esgotada THEN
+        RAISE EXCEPTION 'Bilhetes de segunda classe esgotados para este voo.';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_capacidade_bilhete_insert AFTER INSERT ON bilhete
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION verificar_capacidade_bilhete();
+
+CREATE OR REPLACE TRIGGER trigger_capacidade_bilhete_update AFTER UPDATE ON bilhete
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION verificar_capacidade_bilhete();
+
+CREATE OR REPLACE TRIGGER trigger_capacidade_bilhete_delete AFTER DELETE ON bilhete
+    REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION verificar_capacidade_bilhete();
+
+
+SELECT recalcular_capacidade_voo();
@@ -0,0 +1,18 @@
+-- Estatísticas das consultas da aplicação (app_/desempenho.py)
+--
+-- O bdist-workspace carrega a biblioteca pg_stat_statements
+-- (shared_preload_libraries), mas stat_extension.sql só cria a extensão na
+-- base de dados postgres; tem de ser criada também na base de dados da
+-- aplicação, por um superutilizador.
+
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
+
+-- Fotografias do pg_stat_statements, para comparar dois momentos (antes e
+-- depois de um deploy ou de um índice novo). dados tem os totais acumulados
+-- de cada consulta nomeada, tal como devolvidos por desempenho.ler().
+CREATE TABLE IF NOT EXISTS snapshot_consultas (
+    id SERIAL PRIMARY KEY,
+    nome VARCHAR(80),
+    criado TIMESTAMPTZ NOT NULL DEFAULT now(),
+    dados JSONB NOT NULL
+);
@@ -0,0 +1,338 @@
+-- estatisticas_voos mantida de forma incremental
+--
+-- A vista materializada do relatório só se atualiza com REFRESH, que volta a
+-- agregar todos os bilhetes e bloqueia as leituras enquanto corre. Aqui
+-- estatisticas_voos passa a ser uma tabela com as mesmas colunas (mais
+-- voo_id), atualizada pelos triggers na mesma transação que altera voo,
+-- assento, aeroporto ou bilhete: uma compra só atualiza a linha do seu voo.
+-- As leituras nunca esperam (MVCC) e veem sempre os dados confirmados.
+--
+-- Os triggers de bilhete são por instrução (FOR EACH STATEMENT), como os de
+-- capacidade.sql: um INSERT de N bilhetes atualiza cada voo uma única vez. Um
+-- check-in só muda o lugar e não toca nas estatísticas.
+--
+-- Substitui a vista materializada se existir e pode ser executado sobre uma
+-- base de dados já carregada: a tabela é reconstruída no fim do ficheiro.
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'estatisticas_voos') THEN
+        DROP MATERIALIZED VIEW estatisticas_voos;
+    END IF;
+END;
+$$;
+
+
+-- A consulta da vista materializada, calculada de raiz. Difere dela só nos
+-- voos de aviões sem assentos, que aqui aparecem com 0 assentos.
+-- Agrupa pela chave primária de voo, que em particoes.sql inclui hora_partida.
+CREATE OR REPLACE VIEW estatisticas_voos_completa AS
+SELECT
+    v.id AS voo_id,
+    v.no_serie,
+    v.hora_partida,
+    a1.cidade AS cidade_partida,
+    a1.pais AS pais_partida,
+    a2.cidade AS cidade_chegada,
+    a2.pais AS pais_chegada,
+    EXTRACT(YEAR FROM v.hora_partida) AS ano,
+    EXTRACT(MONTH FROM v.hora_partida) AS mes,
+    EXTRACT(DAY FROM v.hora_partida) AS dia_do_mes,
+    EXTRACT(DOW FROM v.hora_partida) AS dia_da_semana,
+    COUNT(b.id) FILTER (WHERE b.prim_classe = TRUE) AS passageiros_1c,
+    COUNT(b.id) FILTER (WHERE b.prim_classe = FALSE) AS passageiros_2c,
+    COALESCE(MAX(ass.assentos_1c), 0) AS assentos_1c,
+    COALESCE(MAX(ass.assentos_2c), 0) AS assentos_2c,
+    SUM(b.preco) FILTER (WHERE b.prim_classe = TRUE) AS vendas_1c,
+    SUM(b.preco) FILTER (WHERE b.prim_classe = FALSE) AS vendas_2c
+FROM voo v
+JOIN aeroporto a1 ON v.partida = a1.codigo
+JOIN aeroporto a2 ON v.chegada = a2.codigo
+LEFT JOIN bilhete b ON v.id = b.voo_id
+LEFT JOIN (SELECT no_serie,
+                  COUNT(*) FILTER (WHERE prim_classe = TRUE) AS assentos_1c,
+                  COUNT(*) FILTER (WHERE prim_classe = FALSE) AS assentos_2c
+           FROM assento
+           GROUP BY no_serie) ass ON v.no_serie = ass.no_serie
+GROUP BY v.id, v.hora_partida, a1.cidade, a1.pais, a2.cidade, a2.pais;
+
+
+CREATE TABLE IF NOT EXISTS estatisticas_voos (
+    voo_id INTEGER PRIMARY KEY,
+    no_serie VARCHAR(80),
+    hora_partida TIMESTAMP,
+    cidade_partida VARCHAR(255),
+    pais_partida VARCHAR(255),
+    cidade_chegada VARCHAR(255),
+    pais_chegada VARCHAR(255),
+    ano NUMERIC,
+    mes NUMERIC,
+    dia_do_mes NUMERIC,
+    dia_da_semana NUMERIC,
+    passageiros_1c BIGINT NOT NULL DEFAULT 0,
+    passageiros_2c BIGINT NOT NULL DEFAULT 0,
+    assentos_1c BIGINT NOT NULL DEFAULT 0,
+    assentos_2c BIGINT NOT NULL DEFAULT 0,
+    vendas_1c NUMERIC,
+    vendas_2c NUMERIC
+);
+
+
+-- A linha de um voo apagado sai com ele; com voo particionado (particoes.sql)
+-- é apagada por trigger, como em capacidade.sql
+CREATE OR REPLACE FUNCTION apagar_estatisticas_voo() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM estatisticas_voos WHERE voo_id IN (SELECT id FROM antigos);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'voo'::regclass) THEN
+        ALTER TABLE estatisticas_voos DROP CONSTRAINT IF EXISTS estatisticas_voos_voo_id_fkey;
+
+        CREATE OR REPLACE TRIGGER trigger_apagar_estatisticas_voo AFTER DELETE ON voo
+            REFERENCING OLD TABLE AS antigos
+            FOR EACH STATEMENT EXECUTE FUNCTION apagar_estatisticas_voo();
+    ELSIF NOT EXISTS (SELECT 1 FROM pg_constraint
+                      WHERE conrelid = 'estatisticas_voos'::regclass AND conname = 'estatisticas_voos_voo_id_fkey') THEN
+        ALTER TABLE estatisticas_voos ADD FOREIGN KEY (voo_id) REFERENCES voo ON DELETE CASCADE;
+    END IF;
+END;
+$$;
+
+
+-- Os índices do relatório (ponto 6), que desaparecem com a vista materializada
+CREATE INDEX IF NOT EXISTS idx_rotas ON estatisticas_voos (LEAST(cidade_partida, cidade_chegada), GREATEST(cidade_partida, cidade_chegada));
+CREATE INDEX IF NOT EXISTS idx_temporal ON estatisticas_voos (dia_da_semana, mes, ano);
+
+
+-- Linhas que não batem certo com o cálculo de raiz (deve estar sempre vazia;
+-- app_/tests/test_estatisticas.py verifica-a depois de cada tipo de escrita)
+CREATE OR REPLACE VIEW estatisticas_voos_divergencias AS
+SELECT COALESCE(e.voo_id, c.voo_id) AS voo_id,
+       e.passageiros_1c, e.passageiros_2c, e.vendas_1c, e.vendas_2c,
+       c.passageiros_1c AS passageiros_1c_reais, c.passageiros_2c AS passageiros_2c_reais,
+       c.vendas_1c AS vendas_1c_reais, c.vendas_2c AS vendas_2c_reais
+FROM estatisticas_voos e
+FULL JOIN estatisticas_voos_completa c ON c.voo_id = e.voo_id
+WHERE (e.voo_id, e.no_serie, e.hora_partida, e.cidade_partida, e.pais_partida, e.cidade_chegada, e.pais_chegada,
+       e.ano, e.mes, e.dia_do_mes, e.dia_da_semana, e.passageiros_1c, e.passageiros_2c,
+       e.assentos_1c, e.assentos_2c, e.vendas_1c, e.vendas_2c)
+      IS DISTINCT FROM
+      (c.voo_id, c.no_serie, c.hora_partida, c.cidade_partida, c.pais_partida, c.cidade_chegada, c.pais_chegada,
+       c.ano, c.mes, c.dia_do_mes, c.dia_da_semana, c.passageiros_1c, c.passageiros_2c,
+       c.assentos_1c, c.assentos_2c, c.vendas_1c, c.vendas_2c);
+
+
+-- Reconstrói a tabela de raiz (migração, ou depois de uma carga com os
+-- triggers de bilhete desligados). As vendas esperam pelo fim; as leituras
+-- continuam a ver as linhas antigas até ao commit.
+CREATE OR REPLACE FUNCTION reconstruir_estatisticas_voos() RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE bilhete IN SHARE MODE;
+    LOCK TABLE estatisticas_voos IN EXCLUSIVE MODE;
+
+    DELETE FROM estatisticas_voos;
+
+    INSERT INTO estatisticas_voos
+    SELECT * FROM estatisticas_voos_completa;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Voos novos começam sem bilhetes; um voo alterado é recalculado de raiz
+CREATE OR REPLACE FUNCTION atualizar_estatisticas_voo() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO estatisticas_voos
+        SELECT n.id, n.no_serie, n.hora_partida,
+               a1.cidade, a1.pais, a2.cidade, a2.pais,
+               EXTRACT(YEAR FROM n.hora_partida), EXTRACT(MONTH FROM n.hora_partida),
+               EXTRACT(DAY FROM n.hora_partida), EXTRACT(DOW FROM n.hora_partida),
+               0, 0, COALESCE(ass.assentos_1c, 0), COALESCE(ass.assentos_2c, 0), NULL, NULL
+        FROM novos n
+        JOIN aeroporto a1 ON n.partida = a1.codigo
+        JOIN aeroporto a2 ON n.chegada = a2.codigo
+        LEFT JOIN (SELECT no_serie,
+                          COUNT(*) FILTER (WHERE prim_classe = TRUE) AS assentos_1c,
+                          COUNT(*) FILTER (WHERE prim_classe = FALSE) AS assentos_2c
+                   FROM assento
+                   WHERE no_serie IN (SELECT no_serie FROM novos)
+                   GROUP BY no_serie) ass ON n.no_serie = ass.no_serie;
+    ELSE
+        DELETE FROM estatisticas_voos WHERE voo_id IN (SELECT id FROM novos);
+
+        INSERT INTO estatisticas_voos
+        SELECT * FROM estatisticas_voos_completa WHERE voo_id IN (SELECT id FROM novos);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_voo_insert AFTER INSERT ON voo
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_voo();
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_voo_update AFTER UPDATE ON voo
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_voo();
+
+
+-- Cidade ou país de um aeroporto alterados
+CREATE OR REPLACE FUNCTION atualizar_estatisticas_aeroporto() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE estatisticas_voos e
+    SET cidade_partida = a1.cidade, pais_partida = a1.pais,
+        cidade_chegada = a2.cidade, pais_chegada = a2.pais
+    FROM voo v
+    JOIN aeroporto a1 ON v.partida = a1.codigo
+    JOIN aeroporto a2 ON v.chegada = a2.codigo
+    WHERE e.voo_id = v.id
+      AND (v.partida IN (SELECT codigo FROM novos) OR v.chegada IN (SELECT codigo FROM novos));
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_aeroporto AFTER UPDATE ON aeroporto
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_aeroporto();
+
+
+-- Assentos acrescentados, retirados ou alterados (p.ex. a classe) mudam os
+-- assentos dos voos do avião; um UPDATE conta como retirar as linhas antigas e
+-- acrescentar as novas, como em capacidade.sql
+CREATE OR REPLACE FUNCTION atualizar_estatisticas_assento() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE estatisticas_voos e
+        SET assentos_1c = e.assentos_1c + d.n_1c, assentos_2c = e.assentos_2c + d.n_2c
+        FROM (SELECT no_serie,
+                     COUNT(*) FILTER (WHERE prim_classe = TRUE) AS n_1c,
+                     COUNT(*) FILTER (WHERE prim_classe = FALSE) AS n_2c
+              FROM novos GROUP BY no_serie) d
+        WHERE e.no_serie = d.no_serie;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE estatisticas_voos e
+        SET assentos_1c = e.assentos_1c - d.n_1c, assentos_2c = e.assentos_2c - d.n_2c
+        FROM (SELECT no_serie,
+                     COUNT(*) FILTER (WHERE prim_classe = TRUE) AS n_1c,
+                     COUNT(*) FILTER (WHERE prim_classe = FALSE) AS n_2c
+              FROM antigos GROUP BY no_serie) d
+        WHERE e.no_serie = d.no_serie;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_assento_insert AFTER INSERT ON assento
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_assento();
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_assento_update AFTER UPDATE ON assento
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_assento();
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_assento_delete AFTER DELETE ON assento
+    REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_assento();
+
+
+-- Bilhetes: soma a variação de passageiros e vendas de cada voo afetado
+CREATE OR REPLACE FUNCTION atualizar_estatisticas_bilhete() RETURNS TRIGGER AS $$
+DECLARE
+    voos INTEGER[];
+    delta_passageiros_1c BIGINT[];
+    delta_passageiros_2c BIGINT[];
+    delta_vendas_1c NUMERIC[];
+    delta_vendas_2c NUMERIC[];
+    atualizados INTEGER;
+BEGIN
+    -- m(voo_id, prim_classe, preco, sinal): +1 por bilhete novo, -1 por bilhete antigo
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(voo_id), array_agg(p_1c), array_agg(p_2c), array_agg(v_1c), array_agg(v_2c)
+        INTO voos, delta_passageiros_1c, delta_passageiros_2c, delta_vendas_1c, delta_vendas_2c
+        FROM (SELECT voo_id,
+                     COUNT(*) FILTER (WHERE prim_classe) AS p_1c,
+                     COUNT(*) FILTER (WHERE NOT prim_classe) AS p_2c,
+                     COALESCE(SUM(preco) FILTER (WHERE prim_classe), 0) AS v_1c,
+                     COALESCE(SUM(preco) FILTER (WHERE NOT prim_classe), 0) AS v_2c
+              FROM novos WHERE voo_id IS NOT NULL
+              GROUP BY voo_id) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(voo_id), array_agg(p_1c), array_agg(p_2c), array_agg(v_1c), array_agg(v_2c)
+        INTO voos, delta_passageiros_1c, delta_passageiros_2c, delta_vendas_1c, delta_vendas_2c
+        FROM (SELECT voo_id,
+                     -COUNT(*) FILTER (WHERE prim_classe) AS p_1c,
+                     -COUNT(*) FILTER (WHERE NOT prim_classe) AS p_2c,
+                     -COALESCE(SUM(preco) FILTER (WHERE prim_classe), 0) AS v_1c,
+                     -COALESCE(SUM(preco) FILTER (WHERE NOT prim_classe), 0) AS v_2c
+              FROM antigos WHERE voo_id IS NOT NULL
+              GROUP BY voo_id) d;
+    ELSE
+        -- Um check-in não muda voo_id, prim_classe nem preco e não gera variação
+        SELECT array_agg(voo_id), array_agg(p_1c), array_agg(p_2c), array_agg(v_1c), array_agg(v_2c)
+        INTO voos, delta_passageiros_1c, delta_passageiros_2c, delta_vendas_1c, delta_vendas_2c
+        FROM (SELECT voo_id,
+                     COALESCE(SUM(sinal) FILTER (WHERE prim_classe), 0) AS p_1c,
+                     COALESCE(SUM(sinal) FILTER (WHERE NOT prim_classe), 0) AS p_2c,
+                     COALESCE(SUM(sinal * preco) FILTER (WHERE prim_classe), 0) AS v_1c,
+                     COALESCE(SUM(sinal * preco) FILTER (WHERE NOT prim_classe), 0) AS v_2c
+              FROM (SELECT voo_id, prim_classe, preco, 1 AS sinal FROM novos
+                    UNION ALL
+                    SELECT voo_id, prim_classe, preco, -1 FROM antigos) m
+              WHERE voo_id IS NOT NULL
+              GROUP BY voo_id) d
+        WHERE p_1c <> 0 OR p_2c <> 0 OR v_1c <> 0 OR v_2c <> 0;
+    END IF;
+
+    IF voos IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- Bloqueia as linhas sempre pela mesma ordem, como em capacidade.sql
+    PERFORM 1
+    FROM estatisticas_voos
+    WHERE voo_id = ANY(voos)
+    ORDER BY voo_id
+    FOR UPDATE;
+
+    -- Sem bilhetes da classe, vendas_* é NULL (SUM sem linhas), como na vista
+    UPDATE estatisticas_voos e
+    SET passageiros_1c = e.passageiros_1c + d.p_1c,
+        passageiros_2c = e.passageiros_2c + d.p_2c,
+        vendas_1c = CASE WHEN e.passageiros_1c + d.p_1c = 0 THEN NULL ELSE COALESCE(e.vendas_1c, 0) + d.v_1c END,
+        vendas_2c = CASE WHEN e.passageiros_2c + d.p_2c = 0 THEN NULL ELSE COALESCE(e.vendas_2c, 0) + d.v_2c END
+    FROM unnest(voos, delta_passageiros_1c, delta_passageiros_2c, delta_vendas_1c, delta_vendas_2c)
+         AS d(voo_id, p_1c, p_2c, v_1c, v_2c)
+    WHERE e.voo_id = d.voo_id;
+
+    GET DIAGNOSTICS atualizados = ROW_COUNT;
+    IF atualizados < cardinality(voos) THEN
+        RAISE EXCEPTION 'Voo sem linha em estatisticas_voos (execute SELECT reconstruir_estatisticas_voos()).';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_bilhete_insert AFTER INSERT ON bilhete
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_bilhete();
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_bilhete_update AFTER UPDATE ON bilhete
+    REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_bilhete();
+
+CREATE OR REPLACE TRIGGER trigger_estatisticas_bilhete_delete AFTER DELETE ON bilhete
+    REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION atualizar_estatisticas_bilhete();
+
+
+SELECT reconstruir_estatisticas_voos();
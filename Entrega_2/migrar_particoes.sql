@@ -0,0 +1,143 @@
+-- Migração de voo, venda e bilhete de aviacao.sql para as tabelas
+-- particionadas de particoes.sql, numa base de dados já carregada
+--
+--   psql -v ON_ERROR_STOP=1 -f migrar_particoes.sql
+--
+-- Corre numa só transação: se algum passo falhar fica tudo como estava. As
+-- tabelas antigas ficam bloqueadas do início ao fim, por isso a aplicação
+-- deve estar parada (com o dataset de gerador.py --scale 10 demora pouco mais
+-- de um minuto).
+--
+--   1. voo, venda e bilhete passam a voo_antiga, venda_antiga e
+--      bilhete_antiga, com as suas restrições, índices e sequências
+--   2. particoes.sql cria as tabelas novas, e criar_particoes() os meses dos
+--      dados até três meses depois de hoje
+--   3. as linhas são copiadas com os mesmos ids, e os bilhetes recebem a
+--      hora_partida do voo e a hora da venda; as sequências continuam onde
+--      estavam
+--   4. os triggers das tabelas antigas (RI-1, RI-3, versoes.sql, ...) são
+--      recriados nas novas, e capacidade.sql e estatisticas.sql, se estiverem
+--      instalados, voltam a correr: trocam a chave estrangeira para voo por um
+--      trigger, passam as vistas para as tabelas novas e recalculam tudo, o
+--      que confirma a cópia
+--   5. as tabelas antigas são apagadas (sem CASCADE: se algo ainda depender
+--      delas, a migração falha e diz o quê)
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+-- 1. Tabelas antigas
+DO $$
+DECLARE
+    tabela TEXT;
+    restricao TEXT;
+    indice TEXT;
+    sequencia TEXT;
+BEGIN
+    FOREACH tabela IN ARRAY ARRAY['voo', 'venda', 'bilhete'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = tabela::regclass) THEN
+            RAISE EXCEPTION '% já está particionada.', tabela;
+        END IF;
+
+        -- Os nomes das restrições e dos índices não se podem repetir, nem entre tabelas
+        -- (renomear o índice de uma chave primária ou UNIQUE renomeia também a restrição)
+        FOR restricao IN
+            SELECT conname FROM pg_constraint WHERE conrelid = tabela::regclass AND contype IN ('c', 'f')
+        LOOP
+            EXECUTE format('ALTER TABLE %I RENAME CONSTRAINT %I TO %I', tabela, restricao, restricao || '_antiga');
+        END LOOP;
+
+        FOR indice IN SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = tabela::regclass LOOP
+            EXECUTE format('ALTER INDEX %s RENAME TO %I', indice, indice || '_antiga');
+        END LOOP;
+
+        FOR sequencia IN
+            SELECT pg_get_serial_sequence(tabela, attname)
+            FROM pg_attribute
+            WHERE attrelid = tabela::regclass AND attnum > 0 AND NOT attisdropped
+              AND pg_get_serial_sequence(tabela, attname) IS NOT NULL
+        LOOP
+            EXECUTE format('ALTER SEQUENCE %s RENAME TO %I', sequencia,
+                           replace(sequencia::regclass::text, tabela || '_', tabela || '_antiga_'));
+        END LOOP;
+
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', tabela, tabela || '_antiga');
+    END LOOP;
+END;
+$$;
+
+
+-- 2. Tabelas particionadas
+\ir particoes.sql
+
+SELECT criar_particoes(min(inicio), greatest(max(fim), localtimestamp + INTERVAL '3 months'))
+FROM (SELECT min(hora_partida) AS inicio, max(hora_partida) AS fim FROM voo_antiga
+      UNION ALL
+      SELECT min(hora), max(hora) FROM venda_antiga) d;
+
+
+-- 3. Dados
+INSERT INTO voo (id, no_serie, hora_partida, hora_chegada, partida, chegada)
+SELECT id, no_serie, hora_partida, hora_chegada, partida, chegada
+FROM voo_antiga;
+
+INSERT INTO venda (codigo_reserva, nif_cliente, balcao, hora)
+SELECT codigo_reserva, nif_cliente, balcao, hora
+FROM venda_antiga;
+
+INSERT INTO bilhete (id, voo_id, hora_partida, codigo_reserva, hora_venda, nome_passegeiro, preco,
+                     prim_classe, lugar, no_serie)
+SELECT b.id, b.voo_id, v.hora_partida, b.codigo_reserva, ve.hora, b.nome_passegeiro, b.preco,
+       b.prim_classe, b.lugar, b.no_serie
+FROM bilhete_antiga b
+LEFT JOIN voo_antiga v ON v.id = b.voo_id
+LEFT JOIN venda_antiga ve ON ve.codigo_reserva = b.codigo_reserva;
+
+SELECT setval(pg_get_serial_sequence('voo', 'id'), last_value, is_called) FROM voo_antiga_id_seq;
+SELECT setval(pg_get_serial_sequence('venda', 'codigo_reserva'), last_value, is_called)
+FROM venda_antiga_codigo_reserva_seq;
+SELECT setval(pg_get_serial_sequence('bilhete', 'id'), last_value, is_called) FROM bilhete_antiga_id_seq;
+
+
+-- 4. Triggers
+DO $$
+DECLARE
+    tabela TEXT;
+    definicao TEXT;
+BEGIN
+    FOREACH tabela IN ARRAY ARRAY['voo', 'venda', 'bilhete'] LOOP
+        FOR definicao IN
+            SELECT pg_get_triggerdef(oid)
+            FROM pg_trigger
+            WHERE tgrelid = (tabela || '_antiga')::regclass AND NOT tgisinternal
+        LOOP
+            EXECUTE regexp_replace(definicao, ' ON \S+ ', format(' ON %I ', tabela));
+        END LOOP;
+    END LOOP;
+END;
+$$;
+
+SELECT to_regclass('capacidade_voo') IS NOT NULL AS tem_capacidade,
+       to_regclass('estatisticas_voos_divergencias') IS NOT NULL AS tem_estatisticas
+\gset
+
+\if :tem_capacidade
+\ir capacidade.sql
+\endif
+
+\if :tem_estatisticas
+\ir estatisticas.sql
+\endif
+
+
+-- 5. Fim
+DROP TABLE bilhete_antiga;
+DROP TABLE venda_antiga;
+DROP TABLE voo_antiga;
+
+COMMIT;
+
+ANALYZE voo;
+ANALYZE venda;
+ANALYZE bilhete;
@@ -0,0 +1,175 @@
+-- voo, venda e bilhete particionados por mês
+--
+-- Variante do esquema de aviacao.sql para quando as tabelas crescem: quase
+-- todas as consultas têm um intervalo de tempo (as partidas das próximas 12
+-- horas, o último ano ou os últimos 3 meses das análises, as vendas de um
+-- dia), e com partições por mês o planeador só lê os meses desse intervalo.
+--
+--   voo      por hora_partida
+--   venda    por hora
+--   bilhete  pela hora_partida do seu voo, copiada para o bilhete
+--
+-- Uso: psql -f aviacao.sql -f particoes.sql e depois os restantes ficheiros
+-- (capacidade.sql, estatisticas.sql, versoes.sql e os triggers RI-1 e RI-3 do
+-- relatório), que funcionam sem alterações. Numa base de dados já carregada
+-- usa-se migrar_particoes.sql. O gerador.py escreve para o esquema de
+-- aviacao.sql: carrega-se primeiro e migra-se depois.
+--
+-- Diferenças para aviacao.sql:
+--
+--   - A chave primária e os UNIQUE de uma tabela particionada têm de incluir
+--     a chave de partição. As chaves passam a ser (id, hora_partida) e
+--     (codigo_reserva, hora), e os UNIQUE de bilhete incluem hora_partida, o
+--     que não muda nada: a chave estrangeira obriga a que seja a do voo.
+--   - bilhete tem hora_partida e hora_venda (a hora da venda), para as chaves
+--     estrangeiras compostas. Quem insere bilhetes tem de as preencher (ver
+--     VENDA_PARTICOES em app_/consultas.py); o ON UPDATE CASCADE mantém-nas
+--     quando a hora do voo ou da venda muda.
+--   - voo.hora_partida e venda.hora passam a ser NOT NULL.
+--   - O id de voo e os dois UNIQUE por hora_chegada não podem ser UNIQUE e
+--     são verificados pelo trigger verificar_unicidade_voo(). Os ids de venda
+--     e bilhete só vêm das sequências e não são verificados.
+--   - capacidade_voo e estatisticas_voos deixam de ter chave estrangeira para
+--     voo (voo.id já não é único por si); capacidade.sql e estatisticas.sql
+--     apagam as linhas dos voos apagados com um trigger.
+--
+-- As linhas fora dos meses criados vão para as partições DEFAULT. Os meses
+-- seguintes criam-se antes de terem dados, com criar_particoes() (p.ex. uma
+-- vez por mês, num cron): um mês que já tenha linhas na partição DEFAULT só
+-- pode ser criado depois de as tirar de lá.
+
+DROP TABLE IF EXISTS voo CASCADE;
+DROP TABLE IF EXISTS venda CASCADE;
+DROP TABLE IF EXISTS bilhete CASCADE;
+
+CREATE TABLE voo (
+	id SERIAL,
+	no_serie VARCHAR(80) REFERENCES aviao,
+	hora_partida TIMESTAMP NOT NULL,
+	hora_chegada TIMESTAMP,
+	partida CHAR(3) REFERENCES aeroporto(codigo),
+	chegada CHAR(3) REFERENCES aeroporto(codigo),
+	PRIMARY KEY (id, hora_partida),
+	UNIQUE (no_serie, hora_partida),
+	UNIQUE (hora_partida, partida, chegada),
+	CHECK (partida!=chegada),
+	CHECK (hora_partida<=hora_chegada)
+) PARTITION BY RANGE (hora_partida);
+
+-- Pesquisa de voos por rota, por ordem de partida (/voos/<partida>/<chegada>)
+CREATE INDEX idx_voo_rota ON voo (partida, chegada, hora_partida);
+
+-- Partidas de um aeroporto por ordem de hora, paginadas por (hora_partida, id) (/partidas/<partida>)
+CREATE INDEX idx_voo_partida ON voo (partida, hora_partida, id);
+
+-- Os UNIQUE (no_serie, hora_chegada) e (hora_chegada, partida, chegada), verificados por trigger
+CREATE INDEX idx_voo_chegada_aviao ON voo (no_serie, hora_chegada);
+CREATE INDEX idx_voo_chegada_rota ON voo (hora_chegada, partida, chegada);
+
+CREATE TABLE venda (
+	codigo_reserva SERIAL,
+	nif_cliente CHAR(9) NOT NULL,
+	balcao CHAR(3) REFERENCES aeroporto(codigo),
+	hora TIMESTAMP NOT NULL,
+	PRIMARY KEY (codigo_reserva, hora)
+) PARTITION BY RANGE (hora);
+
+CREATE TABLE bilhete (
+	id SERIAL,
+	voo_id INTEGER,
+	hora_partida TIMESTAMP,
+	codigo_reserva INTEGER,
+	hora_venda TIMESTAMP,
+	nome_passegeiro VARCHAR(80),
+	preco NUMERIC(7,2) NOT NULL,
+	prim_classe BOOLEAN NOT NULL DEFAULT FALSE,
+	lugar VARCHAR(3),
+	no_serie VARCHAR(80),
+	PRIMARY KEY (id, hora_partida),
+	UNIQUE (voo_id, hora_partida, codigo_reserva, nome_passegeiro),
+	-- Um lugar só pode ser atribuído a um bilhete por voo (os NULL não colidem)
+	UNIQUE (voo_id, hora_partida, lugar),
+	FOREIGN KEY (voo_id, hora_partida) REFERENCES voo (id, hora_partida) ON UPDATE CASCADE,
+	FOREIGN KEY (codigo_reserva, hora_venda) REFERENCES venda (codigo_reserva, hora) ON UPDATE CASCADE,
+	FOREIGN KEY (lugar, no_serie) REFERENCES assento,
+	-- Sem isto a chave estrangeira composta aceitava um voo_id com hora_partida NULL
+	CHECK ((voo_id IS NULL) = (hora_partida IS NULL)),
+	CHECK ((codigo_reserva IS NULL) = (hora_venda IS NULL))
+) PARTITION BY RANGE (hora_partida);
+
+-- Bilhetes de uma venda (/reservas/<reserva>/bilhetes); a chave estrangeira não tem índice
+CREATE INDEX idx_bilhete_reserva ON bilhete (codigo_reserva, id);
+
+CREATE TABLE voo_default PARTITION OF voo DEFAULT;
+CREATE TABLE venda_default PARTITION OF venda DEFAULT;
+CREATE TABLE bilhete_default PARTITION OF bilhete DEFAULT;
+
+
+-- Cria as partições mensais de voo, venda e bilhete, de desde a ate
+-- (inclusive), que ainda não existam (voo_2025_01, venda_2025_01, ...).
+-- Devolve o número de partições criadas.
+CREATE OR REPLACE FUNCTION criar_particoes(desde TIMESTAMP, ate TIMESTAMP) RETURNS INTEGER AS $$
+DECLARE
+    mes TIMESTAMP;
+    tabela TEXT;
+    criadas INTEGER := 0;
+BEGIN
+    FOR mes IN SELECT generate_series(date_trunc('month', desde), date_trunc('month', ate), INTERVAL '1 month') LOOP
+        FOREACH tabela IN ARRAY ARRAY['voo', 'venda', 'bilhete'] LOOP
+            IF to_regclass(tabela || to_char(mes, '_YYYY_MM')) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               tabela || to_char(mes, '_YYYY_MM'), tabela, mes, mes + INTERVAL '1 month');
+                criadas := criadas + 1;
+            END IF;
+        END LOOP;
+    END LOOP;
+
+    RETURN criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- O id e os UNIQUE (no_serie, hora_chegada) e (hora_chegada, partida,
+-- chegada) de aviacao.sql, que não incluem hora_partida. Cada instrução
+-- verifica as suas linhas de uma vez, depois de as escrever. O advisory lock
+-- põe em fila as verificações de transações concorrentes até ao commit, e
+-- cada consulta vê o que as anteriores confirmaram (READ COMMITTED); as
+-- escritas em voo são raras, por isso a fila não custa nada.
+CREATE OR REPLACE FUNCTION verificar_unicidade_voo() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('unicidade_voo'));
+
+    IF EXISTS (
+        SELECT 1 FROM novos n
+        JOIN voo v ON v.id = n.id AND v.hora_partida <> n.hora_partida
+    ) THEN
+        RAISE EXCEPTION 'Já existe um voo com o mesmo id.' USING ERRCODE = 'unique_violation';
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM novos n
+        JOIN voo v ON v.no_serie = n.no_serie AND v.hora_chegada = n.hora_chegada
+        WHERE (v.id, v.hora_partida) <> (n.id, n.hora_partida)
+    ) THEN
+        RAISE EXCEPTION 'O avião já tem um voo a chegar a essa hora.' USING ERRCODE = 'unique_violation';
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM novos n
+        JOIN voo v ON v.hora_chegada = n.hora_chegada AND v.partida = n.partida AND v.chegada = n.chegada
+        WHERE (v.id, v.hora_partida) <> (n.id, n.hora_partida)
+    ) THEN
+        RAISE EXCEPTION 'Já existe um voo nessa rota a chegar a essa hora.' USING ERRCODE = 'unique_violation';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_unicidade_voo_insert AFTER INSERT ON voo
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION verificar_unicidade_voo();
+
+CREATE OR REPLACE TRIGGER trigger_unicidade_voo_update AFTER UPDATE ON voo
+    REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION verificar_unicidade_voo();
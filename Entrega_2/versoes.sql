@@ -0,0 +1,29 @@
+-- Versões dos dados usadas pela cache HTTP da aplicação (app_/cache.py)
+--
+-- Cada INSERT, UPDATE, DELETE ou TRUNCATE em voo ou aeroporto incrementa a
+-- versão da tabela na mesma transação, por isso a nova versão só fica visível
+-- quando as alterações são confirmadas.
+
+CREATE TABLE IF NOT EXISTS versao_dados (
+    tabela VARCHAR(80) PRIMARY KEY,
+    versao BIGINT NOT NULL DEFAULT 1
+);
+
+INSERT INTO versao_dados (tabela) VALUES ('aeroporto'), ('voo')
+ON CONFLICT DO NOTHING;
+
+
+CREATE OR REPLACE FUNCTION incrementar_versao_dados() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE versao_dados SET versao = versao + 1 WHERE tabela = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_versao_aeroporto
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON aeroporto
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_dados();
+
+CREATE OR REPLACE TRIGGER trigger_versao_voo
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON voo
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_dados();